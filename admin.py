@@ -1,24 +1,79 @@
 # embedded/admin.py
+import copy
+import threading
+from collections import OrderedDict
+
 from django.contrib import admin
 from django.contrib.admin.util import unquote, flatten_fieldsets
-from django.db import transaction
-from django.forms.formsets import all_valid
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.conf import settings
+from django.db import models, transaction
+from django.forms.fields import CharField, IntegerField
+from django.forms.formsets import all_valid, INITIAL_FORM_COUNT, TOTAL_FORM_COUNT
 from django.forms.models import (ModelForm, BaseModelFormSet,
-	modelformset_factory)
+	modelformset_factory, model_to_dict)
+from django.forms.util import ErrorDict
+from django.forms.widgets import HiddenInput
+from django.http import Http404, HttpResponse, HttpResponseNotAllowed
+from django.shortcuts import render_to_response
+from django.template import RequestContext
 from django.utils.decorators import method_decorator
-from django.utils.encoding import force_unicode
-from django.utils.functional import curry
+from django.utils.encoding import force_unicode, smart_str
+from django.utils.functional import curry, update_wrapper
+from django.utils.hashcompat import md5_constructor
+from django.utils.html import conditional_escape, escape
+from django.utils.text import get_text_list
+from django.utils import simplejson, translation
 from django.utils.safestring import mark_safe
-from django.utils.translation import gettext_lazy as _
+from django.utils.translation import gettext_lazy as _, ugettext
 from django.views.decorators.csrf import csrf_protect
 
-from embedded.helpers import EmbeddedAdminFormSet
+from embedded.backends import EmbeddedChangeSet, ReplaceBackend
+from embedded.bulk import EmbeddedBulkEdit, EmbeddedBulkEditForm
+from embedded.changelist import (EmbeddedAggregate, EmbeddedChangeList,
+	EmbeddedCount, EmbeddedPreview)
+from embedded.helpers import (EmbeddedAdminFormSet, EmbeddedFormData,
+	ReadOnlyEmbeddedRows, embedded_elements, freeze)
+from embedded.instrumentation import ViewTimings
+from embedded.records import EmbeddedRecord, record_class
+from embedded.transfer import (CHUNK_SIZE, CONTENT_TYPES, FORMATS,
+	EmbeddedImportError, element_values, export_fields, export_lines,
+	import_elements, read_rows)
+from embedded.signals import embedded_view_timed
 
 csrf_protect_m = method_decorator(csrf_protect)
 
+# Management form field holding the start of the edited window.
+WINDOW_OFFSET = 'OFFSET'
+# Management form field holding the positions of the edited elements, when
+# they are not a slice of the list (the results of a search).
+WINDOW_POSITIONS = 'POSITIONS'
+# Management form field holding the version of the embedded list the forms
+# were rendered from.
+VERSION = 'VERSION'
+
 class BaseEmbeddedFormSet(BaseModelFormSet):
+	skip_unchanged_forms = False
+	compact_records = False
+	validation_chunk_size = None
+	versioned = False
+
 	def __init__(self, data=None, files=None, auto_id='id_%s', prefix=None,
-				 queryset=None, instance=None, **kwargs):
+				 queryset=None, instance=None, window=None, **kwargs):
+		self._unchanged_forms = set()
+		# forms whose element is kept as it is in the current list, because
+		# only someone else changed it
+		self._kept_elements = {}
+		self._rebased = False
+		self._released = False
+		# form index -> (nested embedded admin, formset) pairs of the rows
+		# whose nested lists were posted
+		self.nested_formsets = {}
+		# window is an optional (start, stop) slice of the embedded list, or a
+		# list of positions in it; only those elements get forms and the rest
+		# are merged back on save.
+		self.window = window
 		defaults = {'data': data, 'files': files, 'auto_id': auto_id, 'prefix': prefix, 'queryset': queryset}
 		defaults.update(kwargs)
 		
@@ -26,7 +81,13 @@ class BaseEmbeddedFormSet(BaseModelFormSet):
 
 	def _construct_form(self, i, **kwargs):
 		if i < self.initial_form_count() and not kwargs.get('instance'):
-			kwargs['instance'] = self.get_queryset()[i]
+			embedded_list = self.get_queryset()
+			if i < len(embedded_list):
+				kwargs['instance'] = embedded_list[i]
+				if self.versioned:
+					# cleaning the form changes its instance, and the version
+					# check needs the current element untouched
+					kwargs['instance'] = copy.copy(kwargs['instance'])
 		defaults = {'auto_id': self.auto_id, 'prefix': self.add_prefix(i)}
 		if self.is_bound:
 			defaults['data'] = self.data
@@ -45,6 +106,13 @@ class BaseEmbeddedFormSet(BaseModelFormSet):
 		return form
 
 	def get_queryset(self):
+		"""
+		Returns the embedded elements as a tuple.
+
+		The list or manager found on the parent is read only once, so building
+		every form, counting the initial ones and saving don't fetch it again
+		row by row.
+		"""
 		if not hasattr(self, '_queryset'):
 			if self.queryset is not None:
 				qs = self.queryset
@@ -61,15 +129,295 @@ class BaseEmbeddedFormSet(BaseModelFormSet):
 			# Removed queryset limiting here. As per discussion re: #13023
 			# on django-dev, max_num should not prevent existing
 			# related objects/inlines from being displayed.
-			self._queryset = qs
+			self._embedded_list = embedded_elements(qs)
+			if self.window is None:
+				self._queryset = self._embedded_list
+			elif isinstance(self.window, list):
+				self._queryset = tuple([self._embedded_list[p] for p in self.get_positions()])
+			else:
+				self._queryset = self._embedded_list[self.window[0]:self.window[1]]
 		return self._queryset
 
+	def full_clean(self):
+		self.clean_forms()
+		super(BaseEmbeddedFormSet, self).full_clean()
+
+	def is_valid(self):
+		if self._released:
+			# the forms were valid when they were saved
+			return True
+		valid = super(BaseEmbeddedFormSet, self).is_valid()
+		for i in self.nested_formsets:
+			if self.keeps_nested(i):
+				for nested, formset in self.nested_formsets[i]:
+					valid = formset.is_valid() and valid
+		return valid
+
+	def keeps_nested(self, i):
+		"""
+		Returns True if the nested lists posted with form ``i`` are saved: its
+		element is kept and, for an extra form, created.
+		"""
+		form = self.forms[i]
+		if self.can_delete and form._raw_value("DELETE"):
+			return False
+		return i < self.initial_form_count() or form.has_changed()
+
+	def clean_forms(self, start=0, stop=None):
+		"""
+		Cleans the forms from ``start`` to ``stop`` that were not cleaned yet.
+		Chunks of forms may be cleaned concurrently, see
+		EmbeddedAdmin.validate_embedded_formsets.
+		"""
+		initial = self.initial_form_count()
+		for i, form in enumerate(self.forms[start:stop], start):
+			if form._errors is not None:
+				continue
+			if self.skip_unchanged_forms and self.is_bound and i < initial and not form.has_changed():
+				# an empty error dict keeps form.errors from cleaning it
+				form._errors = ErrorDict()
+				self._unchanged_forms.add(form)
+			else:
+				form.full_clean()
+
+	def save_embedded_form(self, form):
+		"""
+		Returns the embedded instance of a form. Unchanged initial forms that
+		were not cleaned keep their original instance, and so do the rows
+		merged from a concurrent edit.
+
+		Valid forms already built their instance while they were cleaned, so
+		it is returned as it is: form.save(commit=False) would build it again
+		and keep a save_m2m closure per form, which embedded elements never
+		use. With compact_records the changed and new elements are returned as
+		EmbeddedRecords instead, so the forms and their instances can be
+		released once the formset is saved.
+		"""
+		if form in self._kept_elements:
+			return self._kept_elements[form]
+		if self.compact_records and form not in self._unchanged_forms and form.has_changed():
+			return record_class(self.model).from_instance(form.instance)
+		return form.instance
+
+	def release_forms(self):
+		"""
+		Drops the forms of a saved formset, with their fields, data and
+		instances. The change set and the changed, new and deleted elements
+		are kept.
+		"""
+		self.forms = []
+		self._errors = []
+		self._unchanged_forms = set()
+		self._kept_elements = {}
+		self.nested_formsets = {}
+		self._released = True
+
+	def _management_form(self):
+		# built once: the form counts read it for every form of the formset
+		if getattr(self, '_management_form_cache', None) is None:
+			form = super(BaseEmbeddedFormSet, self).management_form
+			if isinstance(self.window, list):
+				form.fields[WINDOW_POSITIONS] = CharField(required=False,
+					widget=HiddenInput, initial=','.join([str(p) for p in self.get_positions()]))
+			elif self.window is not None:
+				form.fields[WINDOW_OFFSET] = IntegerField(required=False,
+					widget=HiddenInput, initial=self.window_start())
+			if self.versioned:
+				form.fields[VERSION] = CharField(required=False,
+					widget=HiddenInput, initial=self.get_version)
+			self._management_form_cache = form
+		return self._management_form_cache
+	management_form = property(_management_form)
+
+	def get_embedded_list(self):
+		"""
+		Returns the whole embedded list, including the elements outside the
+		window.
+		"""
+		self.get_queryset()
+		return self._embedded_list
+
+	def window_start(self):
+		if self.window is None:
+			return 0
+		if isinstance(self.window, list):
+			positions = self.get_positions()
+			return positions and positions[0] or 0
+		return min(self.window[0], len(self.get_embedded_list()))
+
+	def get_positions(self):
+		"""
+		Returns the positions in the whole embedded list of the elements that
+		get forms, in order.
+		"""
+		if not hasattr(self, '_positions'):
+			if not hasattr(self, '_embedded_list'):
+				self.get_queryset()
+			length = len(self._embedded_list)
+			if isinstance(self.window, list):
+				self._positions = sorted(set([p for p in self.window if 0 <= p < length]))
+			else:
+				start = self.window_start()
+				self._positions = range(start, start + len(self.get_queryset()))
+		return self._positions
+
+	def position(self, i):
+		"""
+		Returns the position in the whole embedded list of initial form
+		``i``. Forms posted for elements that no longer exist get positions
+		past the end of the list.
+		"""
+		positions = self.get_positions()
+		if i < len(positions):
+			return positions[i]
+		return len(self.get_embedded_list()) + i - len(positions)
+
+	def merge_window(self, objects):
+		"""
+		Puts the saved elements of the window back in their place in the whole
+		embedded list. Elements outside the window are kept untouched.
+		"""
+		if self.window is None:
+			return list(objects)
+		embedded_list = self.get_embedded_list()
+		start = self.window_start()
+		stop = start + len(self.get_queryset())
+		return list(embedded_list[:start]) + list(objects) + list(embedded_list[stop:])
+
+	def row_version(self, element):
+		"""
+		Returns a short hash of the values the forms edit of an element.
+		"""
+		if not hasattr(self, '_version_fields'):
+			names = set(self.form.base_fields)
+			self._version_fields = [f for f in self.model._meta.fields if f.name in names]
+		return md5_constructor(repr([f.value_to_string(element)
+			for f in self._version_fields])).hexdigest()[:8]
+
+	def get_version(self, window=True):
+		"""
+		Returns the version token of the current embedded list: a hash and
+		the length of the whole list, then, with ``window``, a short hash of
+		every element of the window.
+		"""
+		rows = [self.row_version(element) for element in self.get_embedded_list()]
+		version = '%s:%d' % (md5_constructor(''.join(rows)).hexdigest(), len(rows))
+		if not window:
+			return version
+		return '%s:%s' % (version, ''.join([rows[p] for p in self.get_positions()]))
+
+	def clean(self):
+		super(BaseEmbeddedFormSet, self).clean()
+		if self.versioned and self.is_bound:
+			self.check_version()
+
+	def check_version(self):
+		"""
+		Compares the posted version with the current embedded list. When
+		someone else saved it in between, rows only they changed are kept as
+		they saved them and rows only this user changed are saved; rows both
+		changed raise a ValidationError. If elements were added or removed
+		in between, only new elements can be merged.
+		"""
+		posted = self.data.get('%s-%s' % (self.prefix, VERSION))
+		if not posted or posted == self.get_version():
+			return
+		try:
+			digest, length, rows = posted.split(':')
+			length = int(length)
+		except ValueError:
+			return
+		base = [rows[i:i + 8] for i in range(0, len(rows), 8)]
+		current = self.get_queryset()
+		touched = []
+		conflicts = []
+		kept = {}
+		for i, form in enumerate(self.initial_forms):
+			deleted = self.can_delete and form._raw_value("DELETE")
+			if i >= len(base):
+				touched.append(self.position(i))
+				continue
+			mine = form in self._unchanged_forms and base[i] or self.row_version(form.instance)
+			if deleted or mine != base[i] or i in self.nested_formsets:
+				touched.append(self.position(i))
+			if i >= len(current):
+				continue
+			theirs = self.row_version(current[i])
+			if theirs == base[i]:
+				continue
+			if deleted or mine not in (base[i], theirs):
+				conflicts.append(self.position(i))
+			else:
+				kept[form] = current[i]
+		opts = self.model._meta
+		if length != len(self.get_embedded_list()) or len(current) != len(base):
+			if touched:
+				raise ValidationError(ugettext('The %(name)s were added to or removed '
+					'by someone else since this page was loaded. Reload it to see '
+					'their changes.') % {'name': force_unicode(opts.verbose_name_plural)})
+			self._rebased = True
+		elif conflicts:
+			raise ValidationError(ugettext('%(name)s %(positions)s were changed by '
+				'someone else since this page was loaded. Reload the page to see '
+				'their changes.') % {
+					'name': force_unicode(opts.verbose_name_plural).capitalize(),
+					'positions': get_text_list([unicode(p) for p in conflicts[:10]], ugettext('and')),
+				})
+		self._kept_elements = kept
+
+	def save_nested(self, i, element):
+		"""
+		Puts the saved nested lists of form ``i`` on its element. Returns the
+		element, copied if a nested list changed, and the names of the nested
+		lists that changed.
+		"""
+		changed = []
+		for nested, formset in self.nested_formsets.get(i, ()):
+			formset.save_embedded()
+			changeset = formset.changeset
+			if not changeset:
+				continue
+			if not changed:
+				if isinstance(element, EmbeddedRecord):
+					element = element.to_instance()
+				else:
+					element = copy.copy(element)
+			changeset.materialize()
+			setattr(element, changeset.field, changeset.result)
+			changed.append(changeset.field)
+		return element, changed
+
+	def get_changeset(self, output_objects, updates, removals):
+		"""
+		Returns the EmbeddedChangeSet of a save, given the elements kept and
+		the positions updated and removed in the whole embedded list.
+		"""
+		field = self.model._meta.object_name.lower()
+		embedded_list = self.get_embedded_list()
+		if isinstance(self.window, list):
+			# elements may be anywhere in the list: the result is the current
+			# list with the changes applied, the new elements at its end
+			length = len(embedded_list)
+			changeset = EmbeddedChangeSet(field, length,
+				updates=[(p, e) for p, e in updates if p < length],
+				removals=[p for p in removals if p < length],
+				appends=[e for p, e in updates if p >= length] + list(self.new_objects))
+			changeset.result = changeset.apply(embedded_list)
+			return changeset
+		start = self.window_start()
+		return EmbeddedChangeSet(field, len(embedded_list), updates=updates,
+			removals=removals, appends=list(self.new_objects),
+			insert_at=start + len(self.get_queryset()),
+			result=self.merge_window(output_objects))
+
 	def save_embedded(self):
 		"""
 			Replace BaseModelFormSet.save_new_objects for embedded formsets
 			Don't save anything in the db, but create a new list of objects to insert in the new object
 			It is assumed that the data have been validated. Elsewhere the method returns a void list
 		"""			
+		if self._released:
+			return self.changeset.result
 		self.changed_objects = []
 		self.deleted_objects = []
 		self.new_objects = []
@@ -79,22 +427,40 @@ class BaseEmbeddedFormSet(BaseModelFormSet):
 		if not self.is_valid():
 			return []
 			
-		for form in self.initial_forms:
-			embedded_instance = form.save(commit=False)
+		updates = []
+		removals = []
+		
+		if self._rebased:
+			# the list changed under us and only new elements were posted
+			output_objects.extend(self.get_queryset())
+		for i, form in enumerate(not self._rebased and self.initial_forms or ()):
+			embedded_instance = self.save_embedded_form(form)
 			if self.can_delete == True and form._raw_value("DELETE"):
 				self.deleted_objects.append(embedded_instance)
+				removals.append(self.position(i))
 			else:
+				embedded_instance, nested_changed = self.save_nested(i, embedded_instance)
 				output_objects.append(embedded_instance)
-				if form.has_changed():
-					self.changed_objects.append((embedded_instance, form.changed_data))
+				changed_data = []
+				if form.has_changed() and form not in self._kept_elements:
+					changed_data = list(form.changed_data)
+				if changed_data or nested_changed:
+					self.changed_objects.append((embedded_instance, changed_data + nested_changed))
+					updates.append((self.position(i), embedded_instance))
 			
-		for form in self.extra_forms:
+		for i, form in enumerate(self.extra_forms, self.initial_form_count()):
 			if form.has_changed() and not (self.can_delete and form._raw_value("DELETE")): # it has new data and has not been marked for deletion
-				embedded_instance = form.save(commit=False)
+				embedded_instance = self.save_embedded_form(form)
+				embedded_instance, nested_changed = self.save_nested(i, embedded_instance)
 				self.new_objects.append(embedded_instance)
 				output_objects.append(embedded_instance)
 		
-		return output_objects
+		self.changeset = self.get_changeset(output_objects, updates, removals)
+		if self.versioned:
+			self.changeset.version = self.get_version(window=False)
+		if self.compact_records:
+			self.release_forms()
+		return self.changeset.result
 		
 def embeddedformset_factory(parent_model, model, form=ModelForm,
 						  formset=BaseModelFormSet, fk_name=None,
@@ -118,7 +484,182 @@ def embeddedformset_factory(parent_model, model, form=ModelForm,
 	FormSet = modelformset_factory(model, **kwargs)
 	return FormSet
 
+class FormSetCache(object):
+	"""
+	A bounded LRU cache of generated formset classes.
+
+	Building a formset class runs ``modelform_factory`` and the ModelForm
+	metaclass, which is wasted work when the same class is requested again
+	and again by ``add_view``/``change_view``. Keys are built by the callers
+	and must be hashable; the first item of a key is its owner, which is what
+	``invalidate`` matches against.
+	"""
+	def __init__(self, max_size=128):
+		self.max_size = max_size
+		self.hits = 0
+		self.misses = 0
+		self._classes = OrderedDict()
+		self._lock = threading.RLock()
+
+	def get(self, key, factory):
+		"""
+		Returns the class cached under ``key``, calling ``factory()`` to build
+		it on a miss.
+		"""
+		self._lock.acquire()
+		try:
+			try:
+				FormSet = self._classes.pop(key)
+			except KeyError:
+				self.misses += 1
+				FormSet = factory()
+			else:
+				self.hits += 1
+			self._classes[key] = FormSet
+			while len(self._classes) > self.max_size:
+				self._classes.popitem(last=False)
+			return FormSet
+		finally:
+			self._lock.release()
+
+	def invalidate(self, owner=None):
+		"""
+		Drops every class built for ``owner``, or the whole cache if no owner
+		is given.
+		"""
+		self._lock.acquire()
+		try:
+			if owner is None:
+				self._classes.clear()
+			else:
+				for key in [k for k in self._classes if k[0] is owner]:
+					del self._classes[key]
+		finally:
+			self._lock.release()
+
+	def stats(self):
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'size': len(self._classes),
+			'max_size': self.max_size,
+		}
+
+	def __len__(self):
+		return len(self._classes)
+
+formset_cache = FormSetCache()
+
+# Guards the embedded admins cached on the admin sites.
+_embedded_lock = threading.RLock()
+
+def find_embedded_instance(instances, name):
+	"""
+	Returns the embedded admin of ``instances`` over the list ``name``, the
+	lowercased name of its model, or raises Http404.
+	"""
+	for embedded in instances:
+		if embedded.model._meta.object_name.lower() == name:
+			return embedded
+	raise Http404(_('Unknown embedded field %r.') % escape(name))
+
 class EmbeddedModelAdmin(admin.TabularInline):
+	# Generated formset classes are shared between the requests with the same
+	# get_formset_cache_key(). Set it to None to build them on every request.
+	formset = BaseEmbeddedFormSet
+	formset_cache = formset_cache
+	# Number of embedded elements edited at once in change_view. None shows
+	# the whole list.
+	embedded_page_size = None
+	# Lazy embedded lists are not built in change_view; the change page gets a
+	# placeholder and the rows are loaded from EmbeddedAdmin.embedded_view.
+	lazy = False
+	# Don't clean initial forms whose data hasn't changed; their elements are
+	# kept as they are. Leave it off when formset.clean() needs to see every
+	# row, e.g. to check uniqueness across the list.
+	skip_unchanged_forms = False
+	# Put a version of the embedded list in the formset and check it on save:
+	# edits of rows someone else changed since the page was loaded are
+	# rejected, and the rest of both edits are merged.
+	versioned = False
+	# Carry the changed and new elements through the save as EmbeddedRecords
+	# (one slot per field) and drop the forms once the formset is saved; the
+	# records become model instances when the parent is saved.
+	compact_records = False
+	# Rows validated per task when the EmbeddedAdmin validates concurrently
+	# (see EmbeddedAdmin.validation_workers). None validates the whole
+	# formset in one task.
+	validation_chunk_size = None
+	# Seconds the rendered rows of read-only embedded lists are cached for.
+	# 0 disables the cache.
+	readonly_cache_timeout = 300
+	# Template of the read-only embedded list on the change page, rendered
+	# with the ReadOnlyEmbeddedRows as ``rows``; it should match
+	# render_readonly_row.
+	readonly_template = 'embedded/readonly_tabular.html'
+	# Fields searched by the search box of the embedded list (the text
+	# fields of the model by default), and fields it can be filtered by.
+	# Only the matching elements get forms.
+	search_fields = None
+	list_filter = ()
+	# Seconds the search index of an embedded list is cached for. 0 disables
+	# the cache.
+	search_cache_timeout = 300
+	# Embedded admins of the lists held by every element of this one. Their
+	# forms are only built for the rows expanded on the page (see
+	# EmbeddedAdmin.embedded_nested_view) and their changes are saved as a
+	# change of the element holding them.
+	embedded = []
+
+	def get_embedded_instances(self):
+		if not hasattr(self, '_embedded_instances'):
+			_embedded_lock.acquire()
+			try:
+				if not hasattr(self, '_embedded_instances'):
+					self._embedded_instances = [embedded_class(self.model, self.admin_site)
+						for embedded_class in self.embedded]
+			finally:
+				_embedded_lock.release()
+		return self._embedded_instances
+	embedded_instances = property(get_embedded_instances)
+
+	def get_nested_instance(self, name):
+		"""
+		Returns the nested embedded admin of the list ``name``.
+		"""
+		return find_embedded_instance(self.embedded_instances, name)
+
+	def construct_nested_formsets(self, request, obj, formset, data, files=None):
+		"""
+		Builds the formsets of the nested lists posted with ``formset``, that
+		is of the rows that were expanded, and keeps them in
+		``formset.nested_formsets``. The other rows keep their nested lists
+		untouched and never get nested forms.
+		"""
+		if not self.embedded_instances:
+			return
+		elements = formset.get_queryset()
+		initial = formset.initial_form_count()
+		path = getattr(formset, 'embedded_path', None) or formset.prefix
+		nested_admins = [nested for nested in self.embedded_instances
+			if not nested.is_readonly(request, obj)]
+		for i in range(formset.total_form_count()):
+			for nested in nested_admins:
+				name = nested.model._meta.object_name.lower()
+				prefix = '%s-%s' % (formset.add_prefix(i), name)
+				if '%s-%s' % (prefix, TOTAL_FORM_COUNT) not in data:
+					continue
+				if i < initial and i < len(elements):
+					queryset = nested.queryset(request, elements[i])
+				else:
+					queryset = []
+				FormSet = nested.get_formset(request, obj)
+				nested_formset = FormSet(data, files, prefix=prefix,
+					queryset=queryset, instance=nested.model)
+				nested_formset.embedded_path = '%s/%d/%s' % (path, formset.position(i), name)
+				nested.construct_nested_formsets(request, obj, nested_formset, data, files)
+				formset.nested_formsets.setdefault(i, []).append((nested, nested_formset))
+
 	def queryset(self, request, parent_instance=None):
 		"""
 		Returns a QuerySet of all model instances that can be edited by the
@@ -131,6 +672,32 @@ class EmbeddedModelAdmin(admin.TabularInline):
 
 		return qs
 
+	def get_formset_cache_key(self, request, obj=None):
+		"""
+		Returns what the formset class built for ``request`` depends on besides
+		the formset options, e.g. the user, or None to build it for every
+		request. The cached class keeps the fields of the request that built
+		it, so admins overriding the formfield_for_* hooks, which are called
+		with the request, aren't cached unless they override this too.
+
+		The default hooks only depend on the request through the "add" link
+		of related fields, shown when the user may add the related model, so
+		that permission is part of the key.
+		"""
+		for name in ('formfield_for_dbfield', 'formfield_for_choice_field',
+				'formfield_for_foreignkey', 'formfield_for_manytomany'):
+			if getattr(self.__class__, name).__func__ is not getattr(EmbeddedModelAdmin, name).__func__:
+				return None
+		key = []
+		opts = self.model._meta
+		for db_field in opts.fields + opts.many_to_many:
+			if db_field.rel is None:
+				continue
+			related_modeladmin = self.admin_site._registry.get(db_field.rel.to)
+			if related_modeladmin is not None:
+				key.append((db_field.name, bool(related_modeladmin.has_add_permission(request))))
+		return tuple(key)
+
 	def get_formset(self, request, obj=None, **kwargs):
 		if self.declared_fieldsets:
 			fields = flatten_fieldsets(self.declared_fieldsets)
@@ -141,7 +708,8 @@ class EmbeddedModelAdmin(admin.TabularInline):
 		else:
 			exclude = list(self.exclude)
 		exclude.extend(kwargs.get("exclude", []))
-		exclude.extend(self.get_readonly_fields(request, obj))
+		readonly_fields = self.get_readonly_fields(request, obj)
+		exclude.extend(readonly_fields)
 		# if exclude is an empty list we use None, since that's the actual
 		# default
 		exclude = exclude or None
@@ -155,25 +723,294 @@ class EmbeddedModelAdmin(admin.TabularInline):
 			"max_num": self.max_num,
 			"can_delete": self.can_delete,
 		}
+		explicit_callback = "formfield_callback" in kwargs
 		defaults.update(kwargs)
-		return embeddedformset_factory(self.parent_model, self.model, **defaults)
+		key = request_key = None
+		if self.formset_cache is not None and not explicit_callback:
+			request_key = self.get_formset_cache_key(request, obj)
+		if request_key is not None:
+			try:
+				key = (self, frozenset(readonly_fields), request_key) + tuple(sorted(
+					[(k, freeze(v)) for k, v in defaults.items()
+					 if k != "formfield_callback"]))
+				hash(key)
+			except TypeError:
+				key = None
+		if key is None:
+			FormSet = embeddedformset_factory(self.parent_model, self.model, **defaults)
+		else:
+			FormSet = self.formset_cache.get(key,
+				lambda: embeddedformset_factory(self.parent_model, self.model, **defaults))
+		FormSet.skip_unchanged_forms = self.skip_unchanged_forms
+		FormSet.compact_records = self.compact_records
+		FormSet.validation_chunk_size = self.validation_chunk_size
+		FormSet.versioned = self.versioned
+		return FormSet
+
+	def get_window(self, request, prefix, obj=None):
+		"""
+		Returns the (start, stop) slice of the embedded list edited in this
+		request, the list of positions of the edited elements, or None when
+		the whole list is edited.
+
+		Windowed formsets post their offset (or their positions) with the
+		management form, and the window is rebuilt from it and the number of
+		initial forms. Otherwise, when the list of ``obj`` is searched, the
+		window is the positions of the matching elements, and the page is read
+		from the "<prefix>-page" query string argument.
+		"""
+		if request.method == 'POST':
+			offset_key = '%s-%s' % (prefix, WINDOW_OFFSET)
+			positions_key = '%s-%s' % (prefix, WINDOW_POSITIONS)
+			count_key = '%s-%s' % (prefix, INITIAL_FORM_COUNT)
+			if positions_key in request.POST:
+				try:
+					return [int(p) for p in request.POST[positions_key].split(',') if p]
+				except ValueError:
+					pass
+			if request.POST.get(offset_key):
+				try:
+					start = max(int(request.POST[offset_key]), 0)
+					return (start, start + int(request.POST.get(count_key, 0)))
+				except ValueError:
+					pass
+		try:
+			page = max(int(request.GET.get('%s-page' % prefix, 0)), 0)
+		except ValueError:
+			page = 0
+		search = obj is not None and self.get_search(request, prefix)
+		if search:
+			positions = self.search_embedded(request, obj, *search)
+			if self.embedded_page_size:
+				start = page * self.embedded_page_size
+				positions = positions[start:start + self.embedded_page_size]
+			return positions
+		if not self.embedded_page_size:
+			return None
+		start = page * self.embedded_page_size
+		return (start, start + self.embedded_page_size)
+
+	def get_search_fields(self, request):
+		"""
+		Returns the fields searched by the search box of the embedded list:
+		``search_fields``, or the text fields of the model.
+		"""
+		if self.search_fields is not None:
+			return list(self.search_fields)
+		return [f.name for f in self.model._meta.fields
+			if isinstance(f, (models.CharField, models.TextField))]
+
+	def get_search(self, request, prefix):
+		"""
+		Returns the search terms and the list_filter values of the query
+		string arguments "<prefix>-q" and "<prefix>-<field>", or None when
+		the list is not searched.
+		"""
+		terms = request.GET.get('%s-q' % prefix, '').lower().split()
+		filters = {}
+		for field in self.list_filter:
+			key = '%s-%s' % (prefix, field)
+			if key in request.GET:
+				filters[field] = request.GET[key]
+		if not terms and not filters:
+			return None
+		return terms, filters
+
+	def get_search_index(self, request, obj, elements):
+		"""
+		Returns, per element, the lower cased text of its search fields and the
+		values of its list_filter fields. The index is cached under a hash of
+		the content of the list, so it is only built again when the list
+		changes.
+		"""
+		search_fields = self.get_search_fields(request)
+		fields = self.model._meta.fields
+		content = repr((search_fields, tuple(self.list_filter),
+			[[getattr(element, f.attname, None) for f in fields] for element in elements]))
+		key = 'embedded-search:%s:%s:%s' % (self.model._meta,
+			smart_str(getattr(obj, 'pk', None)), md5_constructor(smart_str(content)).hexdigest())
+		index = None
+		if self.search_cache_timeout:
+			index = cache.get(key)
+		if index is None:
+			index = [(u'\n'.join([force_unicode(getattr(element, name, None) or u'')
+					for name in search_fields]).lower(),
+				dict([(name, force_unicode(getattr(element, name, None)))
+					for name in self.list_filter]))
+				for element in elements]
+			if self.search_cache_timeout:
+				cache.set(key, index, self.search_cache_timeout)
+		return index
+
+	def search_embedded(self, request, obj, terms, filters):
+		"""
+		Returns the positions of the elements of the embedded list of ``obj``
+		containing every search term in one of their search fields and having
+		the list_filter values in ``filters``.
+		"""
+		positions = []
+		for i, (text, values) in enumerate(self.get_search_index(request, obj,
+				self.get_embedded_list(request, obj))):
+			if not [term for term in terms if term not in text] and not [name
+					for name, value in filters.items() if values.get(name) != value]:
+				positions.append(i)
+		return positions
+
+	def get_embedded_list(self, request, obj):
+		"""
+		Returns the elements of the embedded list of ``obj`` as a tuple.
+		"""
+		return embedded_elements(self.queryset(request, obj))
+
+	def has_change_permission(self, request, obj=None):
+		"""
+		Returns True if the embedded list of ``obj`` can be edited. Override
+		it to show the list read-only to some users.
+		"""
+		return True
+
+	def is_readonly(self, request, obj=None):
+		"""
+		Returns True when the embedded list is shown without forms: the user
+		can't change it or every field is readonly.
+		"""
+		if not self.has_change_permission(request, obj):
+			return True
+		readonly = self.get_readonly_fields(request, obj)
+		if not readonly:
+			return False
+		fields = flatten_fieldsets(self.get_fieldsets(request, obj))
+		return not [field for field in fields if field not in readonly]
+
+	def render_readonly_row(self, element, values):
+		"""
+		Returns the HTML of one read-only element given its (label, escaped
+		value) pairs.
+		"""
+		return mark_safe(u'<tr>%s</tr>' % u''.join(
+			[u'<td>%s</td>' % value for label, value in values]))
+
+	def invalidate_formset_cache(self):
+		"""
+		Forgets the formset classes built for this embedded admin. Call it
+		after changing ``form``, ``fields`` or anything else that shapes them.
+		"""
+		if self.formset_cache is not None:
+			self.formset_cache.invalidate(self)
 
 class TabularEmbedded(EmbeddedModelAdmin):
 	template = 'admin/edit_inline/tabular_embedded.html'
 	
 class StackedEmbedded(EmbeddedModelAdmin):
 	template = 'admin/edit_inline/stacked_embedded.html'
+	readonly_template = 'embedded/readonly_stacked.html'
+
+	def render_readonly_row(self, element, values):
+		return mark_safe(u'<div class="inline-related">%s</div>' % u''.join(
+			[u'<div class="form-row"><label>%s:</label><p>%s</p></div>' % (
+				conditional_escape(force_unicode(label)), value) for label, value in values]))
 	
 class EmbeddedAdmin(admin.ModelAdmin):
 	embedded = []
+	# Writes the embedded changes of add_view/change_view. Plug in a
+	# PartialUpdateBackend to save only the changed, added and removed
+	# elements instead of the whole lists.
+	embedded_backend = ReplaceBackend()
+	# A BaseTimingReporter getting the per-phase timings of add_view and
+	# change_view. With DEBUG on they are also sent in an X-Embedded-Timings
+	# response header.
+	timing_reporter = None
+	timings_class = ViewTimings
+	# Number of threads validating the embedded formsets of add_view and
+	# change_view. None validates them one after another in the request
+	# thread. Worth it when the embedded forms wait on slow validators; note
+	# that validators querying the database do it from the pool threads,
+	# outside the request transaction.
+	validation_workers = None
+	# Positions of changed and deleted embedded elements listed in a change
+	# message; the rest are only counted.
+	change_message_limit = 10
+	# Maps embedded lists to fields of the model holding their length, kept
+	# up to date on every save. EmbeddedCount columns read them instead of
+	# the lists.
+	embedded_counters = {}
+	
+	actions = ['export_embedded_csv', 'export_embedded_jsonl', 'bulk_edit_embedded']
+	bulk_edit_template = 'embedded/bulk_edit.html'
+	bulk_edit_class = EmbeddedBulkEdit
 	
 	def __init__(self, model, admin_site):
 		super(EmbeddedAdmin, self).__init__(model, admin_site)
-		self.embedded_instances = []
-		for embedded_class in self.embedded:
-			embedded_instance = embedded_class(self.model, self.admin_site)
-			self.embedded_instances.append(embedded_instance)		
-		
+		self._validation_pool = None
+		self._validation_lock = threading.Lock()
+		self._embedded_instances = None
+
+	def get_embedded_instances(self):
+		"""
+		Returns the instances of the classes in ``embedded``, built on first
+		use rather than at autodiscovery. They are cached on the admin site,
+		so the admins registered with one site for the same model share them.
+		"""
+		if self._embedded_instances is None:
+			_embedded_lock.acquire()
+			try:
+				registry = self.admin_site.__dict__.setdefault('_embedded_registry', {})
+				instances = []
+				for embedded_class in self.embedded:
+					key = (self.model, embedded_class)
+					if key not in registry:
+						registry[key] = embedded_class(self.model, self.admin_site)
+					instances.append(registry[key])
+				self._embedded_instances = instances
+			finally:
+				_embedded_lock.release()
+		return self._embedded_instances
+
+	def set_embedded_instances(self, instances):
+		self._embedded_instances = list(instances)
+	embedded_instances = property(get_embedded_instances, set_embedded_instances)
+
+	def get_validation_pool(self):
+		self._validation_lock.acquire()
+		try:
+			if self._validation_pool is None:
+				# multiprocessing is only imported by admins that validate
+				# concurrently
+				from multiprocessing.pool import ThreadPool
+				self._validation_pool = ThreadPool(self.validation_workers)
+			return self._validation_pool
+		finally:
+			self._validation_lock.release()
+
+	def validate_embedded_formsets(self, request, formsets):
+		"""
+		Returns True if every embedded formset is valid.
+
+		With validation_workers the forms are cleaned in a thread pool first,
+		a formset (or validation_chunk_size rows of one) per task, with the
+		language of the request. Formset wide validation then runs in order
+		in the request thread, so the errors are the same, in the same order,
+		as when validating sequentially.
+		"""
+		if self.validation_workers:
+			tasks = []
+			for formset in formsets:
+				size = formset.validation_chunk_size or len(formset.forms) or 1
+				for start in range(0, len(formset.forms), size):
+					tasks.append((formset, start, start + size))
+			language = translation.get_language()
+
+			def clean(task):
+				translation.activate(language)
+				try:
+					formset, start, stop = task
+					formset.clean_forms(start, stop)
+				finally:
+					translation.deactivate()
+			if len(tasks) > 1:
+				self.get_validation_pool().map(clean, tasks)
+		return all_valid(formsets)
+
 	def get_formsets(self, request, obj=None):
 		for inline in self.inline_instances:
 			yield inline.get_formset(request, obj)
@@ -182,6 +1019,656 @@ class EmbeddedAdmin(admin.ModelAdmin):
 		for embedded in self.embedded_instances:
 			yield embedded.get_formset(request, obj)
 
+	def get_urls(self):
+		from django.conf.urls.defaults import patterns, url
+
+		def wrap(view):
+			def wrapper(*args, **kwargs):
+				return self.admin_site.admin_view(view)(*args, **kwargs)
+			return update_wrapper(wrapper, view)
+
+		info = self.model._meta.app_label, self.model._meta.module_name
+		urlpatterns = patterns('',
+			url(r'^(.+)/embedded/([\w-]+)/patch/$',
+				wrap(self.embedded_patch_view),
+				name='%s_%s_embedded_patch' % info),
+			url(r'^(.+)/embedded/([\w-]+)/export/$',
+				wrap(self.embedded_export_view),
+				name='%s_%s_embedded_export' % info),
+			url(r'^(.+)/embedded/([\w-]+)/import/$',
+				wrap(self.embedded_import_view),
+				name='%s_%s_embedded_import' % info),
+			url(r'^(.+)/embedded/([\w-]+)/((?:\d+/[\w-]+/)+)$',
+				wrap(self.embedded_nested_view),
+				name='%s_%s_embedded_nested' % info),
+			url(r'^(.+)/embedded/([\w-]+)/$',
+				wrap(self.embedded_view),
+				name='%s_%s_embedded' % info),
+		)
+		return urlpatterns + super(EmbeddedAdmin, self).get_urls()
+
+	def get_changelist(self, request, **kwargs):
+		return EmbeddedChangeList
+
+	def get_deferred_embedded(self, list_display):
+		"""
+		Returns the embedded list fields of the model that no column of
+		``list_display`` reads. Columns name the lists they read in their
+		``embedded_fields`` attribute, and so can admin and model methods.
+		Nothing is deferred unless some column names its lists that way:
+		other columns, like ``__str__``, may read any field of the object.
+		"""
+		columns = []
+		for column in list_display:
+			if not callable(column):
+				column = getattr(self, column, None) or getattr(self.model, column, None)
+			columns.append(column)
+		if not [c for c in columns if hasattr(c, 'embedded_fields')]:
+			return []
+		opts = self.model._meta
+		names = set([f.name for f in opts.fields])
+		embedded_fields = [embedded_class.model._meta.object_name.lower()
+			for embedded_class in self.embedded]
+		embedded_fields = [name for name in embedded_fields if name in names]
+		if not embedded_fields:
+			return []
+		read = set([column for column in list_display if not callable(column)])
+		for column in columns:
+			read.update(getattr(column, 'embedded_fields', ()))
+		return [name for name in embedded_fields if name not in read]
+
+	def count_embedded(self, changeset):
+		"""
+		Puts the new length of the embedded list of ``changeset`` in its
+		counter field, if it has one in ``embedded_counters``.
+		"""
+		counter = self.embedded_counters.get(changeset.field)
+		if counter is not None and changeset.result is not None:
+			changeset.counters[counter] = len(changeset.result)
+		return changeset
+
+	def get_embedded_object(self, request, object_id):
+		"""
+		Returns the object of an embedded view, once the user is known to be
+		allowed to change it.
+		"""
+		opts = self.model._meta
+		obj = self.get_object(request, unquote(object_id))
+
+		if not self.has_change_permission(request, obj):
+			raise PermissionDenied
+
+		if obj is None:
+			raise Http404(_('%(name)s object with primary key %(key)r does not exist.') % {'name': force_unicode(opts.verbose_name), 'key': escape(object_id)})
+		return obj
+
+	def check_embedded_change(self, request, obj, embedded):
+		"""
+		Raises PermissionDenied unless the user can change the embedded list
+		of ``obj``. Every write of an embedded list outside the change form
+		goes through it.
+		"""
+		if not embedded.has_change_permission(request, obj):
+			raise PermissionDenied
+
+	def get_embedded_instance(self, name):
+		"""
+		Returns the embedded admin whose formset prefix is ``name``.
+		"""
+		return find_embedded_instance(self.embedded_instances, name)
+
+	def get_readonly_embedded(self, request, obj, embedded, prefix, elements=None):
+		"""
+		Returns the rows of an embedded list shown without forms: its
+		``elements``, the whole list of ``obj`` by default.
+		"""
+		if elements is None:
+			elements = embedded.get_embedded_list(request, obj)
+		return ReadOnlyEmbeddedRows(embedded, obj, prefix, elements,
+			flatten_fieldsets(embedded.get_fieldsets(request, obj)),
+			cache=cache, timeout=embedded.readonly_cache_timeout)
+
+	def get_lazy_placeholder(self, embedded, prefix):
+		"""
+		Returns what the change page gets instead of the formset of a lazy
+		embedded admin.
+		"""
+		return {
+			'name': prefix,
+			'verbose_name': embedded.verbose_name_plural,
+			'template': embedded.template,
+			'url': 'embedded/%s/' % prefix,
+		}
+
+	def embedded_view(self, request, object_id, name):
+		"""
+		Returns the rendered rows of one embedded formset of an object, from
+		the ``offset`` and ``limit`` query string arguments. When the list is
+		searched (see EmbeddedModelAdmin.get_search) they apply to the
+		matching elements. Read-only lists get their rows without forms.
+		"""
+		opts = self.model._meta
+		obj = self.get_embedded_object(request, object_id)
+		embedded = self.get_embedded_instance(name)
+		try:
+			offset = max(int(request.GET.get('offset', 0)), 0)
+			limit = int(request.GET.get('limit') or embedded.embedded_page_size or 0)
+		except ValueError:
+			return HttpResponse(_('Invalid offset or limit.'), status=400)
+		search = embedded.get_search(request, name)
+		if search:
+			matches = embedded.search_embedded(request, obj, *search)
+			window = matches[offset:limit > 0 and offset + limit or None]
+		elif limit > 0:
+			window = (offset, offset + limit)
+		else:
+			window = (offset, None)
+
+		if embedded.is_readonly(request, obj):
+			elements = embedded.get_embedded_list(request, obj)
+			if search:
+				elements = [elements[p] for p in window]
+			else:
+				elements = elements[window[0]:window[1]]
+			return HttpResponse(self.get_readonly_embedded(request, obj, embedded,
+				name, elements).render())
+
+		FormSet = embedded.get_formset(request, obj)
+		formset = FormSet(instance=embedded.model, prefix=name,
+						  queryset=embedded.queryset(request, obj),
+						  window=window)
+		if search:
+			total = len(matches)
+		else:
+			total = len(formset.get_embedded_list())
+		fieldsets = list(embedded.get_fieldsets(request, obj))
+		readonly = list(embedded.get_readonly_fields(request, obj))
+		embedded_admin_formset = EmbeddedAdminFormSet(embedded, formset,
+			fieldsets, readonly, model_admin=self)
+		context = {
+			'inline_admin_formset': embedded_admin_formset,
+			'embedded_admin_formset': embedded_admin_formset,
+			'original': obj,
+			'offset': offset,
+			'total': total,
+			'app_label': opts.app_label,
+		}
+		return render_to_response(embedded.template, context,
+			context_instance=RequestContext(request))
+
+	def embedded_nested_view(self, request, object_id, name, path):
+		"""
+		Returns the rendered forms of a nested embedded list, for a row
+		expanded on the change page. ``path`` is a list of "<position>/<name>/"
+		steps from an element of the embedded list ``name`` down to the nested
+		list. The forms get the prefixes the change view reads them from;
+		when a window of the top list is edited, the position of the element
+		minus the index of its form is given in the ``offset`` query string
+		argument. The list gets its rows without forms when it, or a list
+		holding it, is read-only.
+		"""
+		opts = self.model._meta
+		obj = self.get_embedded_object(request, object_id)
+		embedded = self.get_embedded_instance(name)
+		try:
+			offset = max(int(request.GET.get('offset', 0)), 0)
+		except ValueError:
+			return HttpResponse(_('Invalid offset.'), status=400)
+		steps = path.strip('/').split('/')
+		parent = obj
+		prefix = name
+		readonly = embedded.is_readonly(request, obj)
+		for position, nested_name in zip(steps[::2], steps[1::2]):
+			position = int(position)
+			elements = embedded.get_embedded_list(request, parent)
+			if not offset <= position < len(elements):
+				raise Http404(_('Unknown embedded element %r.') % escape(path))
+			parent = elements[position]
+			prefix = '%s-%d-%s' % (prefix, position - offset, nested_name)
+			# only the top list is edited in windows
+			offset = 0
+			embedded = embedded.get_nested_instance(nested_name)
+			readonly = readonly or embedded.is_readonly(request, obj)
+
+		if readonly:
+			return HttpResponse(self.get_readonly_embedded(request, obj, embedded,
+				prefix, embedded.get_embedded_list(request, parent)).render())
+
+		FormSet = embedded.get_formset(request, obj)
+		formset = FormSet(instance=embedded.model, prefix=prefix,
+						  queryset=embedded.queryset(request, parent))
+		formset.embedded_path = '%s/%s' % (name, path.strip('/'))
+		fieldsets = list(embedded.get_fieldsets(request, obj))
+		readonly = list(embedded.get_readonly_fields(request, obj))
+		embedded_admin_formset = EmbeddedAdminFormSet(embedded, formset,
+			fieldsets, readonly, model_admin=self)
+		context = {
+			'inline_admin_formset': embedded_admin_formset,
+			'embedded_admin_formset': embedded_admin_formset,
+			'original': obj,
+			'parent': parent,
+			'offset': 0,
+			'total': len(formset.get_embedded_list()),
+			'app_label': opts.app_label,
+		}
+		return render_to_response(embedded.template, context,
+			context_instance=RequestContext(request))
+
+	def apply_embedded_operations(self, request, obj, embedded, operations):
+		"""
+		Applies a list of JSON-patch like operations to one embedded list of
+		``obj`` and returns the new list and a list of (operation index,
+		errors) pairs. Only the replaced and inserted elements are validated,
+		with the form of the embedded admin.
+
+		Operations are dicts with an ``op`` among "replace", "insert",
+		"remove" and "move". Indexes (``index`` and the ``from`` of "move")
+		are integers within the list as left by the previous operations.
+		"replace" only needs the changed fields in ``value``.
+		Raises PermissionDenied if the user can't change the list.
+		"""
+		self.check_embedded_change(request, obj, embedded)
+		FormSet = embedded.get_formset(request, obj)
+		embedded_list = list(embedded.get_embedded_list(request, obj))
+		errors = []
+
+		def validate(i, value, instance):
+			if not isinstance(value, dict):
+				errors.append((i, {'value': [_('Expected an object.')]}))
+				return None
+			data = {}
+			if instance is not None:
+				data = model_to_dict(instance, fields=FormSet.form.base_fields.keys())
+			data.update(value)
+			form = FormSet.form(data=data, instance=instance)
+			if not form.is_valid():
+				errors.append((i, form.errors))
+				return None
+			return form.save(commit=False)
+
+		def check_index(index, length):
+			# True and False are ints too
+			if isinstance(index, bool) or not isinstance(index, (int, long)) or not 0 <= index < length:
+				raise IndexError(index)
+			return index
+
+		for i, operation in enumerate(operations):
+			try:
+				op = operation['op']
+				index = operation.get('index', len(embedded_list))
+				if op == 'replace':
+					check_index(index, len(embedded_list))
+					element = validate(i, operation.get('value'), copy.copy(embedded_list[index]))
+					if element is not None:
+						embedded_list[index] = element
+				elif op == 'insert':
+					check_index(index, len(embedded_list) + 1)
+					element = validate(i, operation.get('value'), None)
+					if element is not None:
+						embedded_list.insert(index, element)
+				elif op == 'remove':
+					del embedded_list[check_index(index, len(embedded_list))]
+				elif op == 'move':
+					source = check_index(operation['from'], len(embedded_list))
+					check_index(index, len(embedded_list))
+					embedded_list.insert(index, embedded_list.pop(source))
+				else:
+					errors.append((i, {'op': [_('Unknown operation %r.') % op]}))
+			except (KeyError, IndexError, TypeError, AttributeError):
+				errors.append((i, {'index': [_('Invalid operation.')]}))
+		return embedded_list, errors
+
+	@csrf_protect_m
+	@transaction.commit_on_success
+	def embedded_patch_view(self, request, object_id, name):
+		"""
+		Saves a JSON list of operations against one embedded list of an
+		object. See ``apply_embedded_operations`` for the operations.
+		"""
+		if request.method != 'POST':
+			return HttpResponseNotAllowed(['POST'])
+
+		obj = self.get_embedded_object(request, object_id)
+		embedded = self.get_embedded_instance(name)
+		try:
+			operations = simplejson.loads(request.raw_post_data)
+		except ValueError:
+			operations = None
+		if not isinstance(operations, list):
+			return self._json_response({'errors': [_('Expected a list of operations.')]}, status=400)
+
+		embedded_list, errors = self.apply_embedded_operations(request, obj, embedded, operations)
+		if errors:
+			return self._json_response({'errors': [
+				{'operation': i, 'errors': dict([(field, [force_unicode(message) for message in messages])
+					for field, messages in field_errors.items()])}
+				for i, field_errors in errors]}, status=400)
+
+		field = embedded.model._meta.object_name.lower()
+		setattr(obj, field, embedded_list)
+		if field in self.embedded_counters:
+			setattr(obj, self.embedded_counters[field], len(embedded_list))
+		self.save_model(request, obj, None, change=True)
+		self.log_change(request, obj, _('Changed %(name)s: %(count)d operations.') % {
+			'name': force_unicode(embedded.verbose_name_plural), 'count': len(operations)})
+		return self._json_response({'length': len(embedded_list)})
+
+	def export_embedded(self, request, obj, embedded, format):
+		"""
+		Returns a generator of the lines of one embedded list of ``obj`` in
+		``format`` ("csv" or "jsonl").
+		"""
+		fields = export_fields(embedded.get_formset(request, obj).form)
+		rows = (element_values(element, fields)
+			for element in embedded.get_embedded_list(request, obj))
+		return export_lines(format, fields, rows)
+
+	def import_embedded(self, request, obj, embedded, rows, mode='append',
+						chunk_size=CHUNK_SIZE, progress=None):
+		"""
+		Validates ``rows`` of form data with the form of the embedded admin
+		and saves them into the embedded list of ``obj``, after the current
+		elements (``mode`` "append") or instead of them ("replace"). Nothing
+		is saved if a row is invalid: EmbeddedImportError is raised, and
+		nothing is read if the user can't change the list: PermissionDenied.
+
+		Returns the EmbeddedChangeSet that was saved.
+		"""
+		if mode not in ('append', 'replace'):
+			raise ValueError('Unknown import mode %r.' % mode)
+		self.check_embedded_change(request, obj, embedded)
+		FormSet = embedded.get_formset(request, obj)
+		elements = import_elements(rows, FormSet.form, chunk_size=chunk_size,
+			progress=progress)
+		current = list(embedded.get_embedded_list(request, obj))
+		field = embedded.model._meta.object_name.lower()
+		if mode == 'replace':
+			changeset = EmbeddedChangeSet(field, len(current),
+				removals=range(len(current)), appends=elements, result=elements)
+		else:
+			changeset = EmbeddedChangeSet(field, len(current), appends=elements,
+				result=current + elements)
+		self.count_embedded(changeset)
+		self.embedded_backend.save(self, request, obj, None, [changeset], change=True)
+		return changeset
+
+	def get_embedded_export_response(self, lines, format, filename):
+		response = HttpResponse(lines, content_type=CONTENT_TYPES[format])
+		response['Content-Disposition'] = 'attachment; filename=%s.%s' % (filename, format)
+		return response
+
+	def embedded_export_view(self, request, object_id, name):
+		"""
+		Streams one embedded list of an object in the format of the
+		``format`` query string argument, CSV by default.
+		"""
+		opts = self.model._meta
+		obj = self.get_embedded_object(request, object_id)
+		embedded = self.get_embedded_instance(name)
+		format = request.GET.get('format', 'csv')
+		if format not in FORMATS:
+			return HttpResponse(_('Unknown format.'), status=400)
+		return self.get_embedded_export_response(
+			self.export_embedded(request, obj, embedded, format), format,
+			'%s-%s-%s' % (opts.module_name, obj.pk, name))
+
+	@csrf_protect_m
+	@transaction.commit_on_success
+	def embedded_import_view(self, request, object_id, name):
+		"""
+		Imports the uploaded ``file`` into one embedded list of an object. The
+		``format`` ("csv" or "jsonl") and ``mode`` ("append" or "replace")
+		come with the upload.
+		"""
+		if request.method != 'POST':
+			return HttpResponseNotAllowed(['POST'])
+
+		obj = self.get_embedded_object(request, object_id)
+		embedded = self.get_embedded_instance(name)
+		format = request.POST.get('format', 'csv')
+		mode = request.POST.get('mode', 'append')
+		if 'file' not in request.FILES or format not in FORMATS or mode not in ('append', 'replace'):
+			return self._json_response({'errors': [_('Expected a csv or jsonl file and an append or replace mode.')]}, status=400)
+
+		try:
+			changeset = self.import_embedded(request, obj, embedded,
+				read_rows(format, request.FILES['file']), mode=mode)
+		except EmbeddedImportError as e:
+			return self._json_response({'errors': [
+				{'row': number, 'errors': dict([(field, [force_unicode(message) for message in messages])
+					for field, messages in field_errors.items()])}
+				for number, field_errors in e.errors]}, status=400)
+
+		self.log_change(request, obj, _('Imported %(count)d %(name)s.') % {
+			'name': force_unicode(embedded.verbose_name_plural), 'count': len(changeset.appends)})
+		return self._json_response({'length': len(changeset.result),
+			'imported': len(changeset.appends)})
+
+	def export_embedded_rows(self, request, queryset):
+		"""
+		Yields the columns and then the rows of every embedded list of the
+		objects of ``queryset``, each row starting with the primary key of
+		its object and the name of its embedded list.
+		"""
+		columns = ['parent', 'embedded']
+		fields = []
+		for embedded in self.embedded_instances:
+			embedded_fields = export_fields(embedded.get_formset(request).form)
+			fields.append((embedded, embedded_fields))
+			columns.extend([f for f in embedded_fields if f not in columns])
+		yield columns
+		for obj in queryset.iterator():
+			for embedded, embedded_fields in fields:
+				name = embedded.model._meta.object_name.lower()
+				for element in embedded.get_embedded_list(request, obj):
+					values = dict(zip(embedded_fields, element_values(element, embedded_fields)))
+					yield [force_unicode(obj.pk), name] + [values.get(c, u'') for c in columns[2:]]
+
+	def export_embedded_as(self, request, queryset, format):
+		rows = self.export_embedded_rows(request, queryset)
+		columns = next(rows)
+		return self.get_embedded_export_response(export_lines(format, columns, rows),
+			format, '%s-embedded' % self.model._meta.module_name)
+
+	def export_embedded_csv(self, request, queryset):
+		return self.export_embedded_as(request, queryset, 'csv')
+	export_embedded_csv.short_description = _('Export embedded lists as CSV')
+
+	def export_embedded_jsonl(self, request, queryset):
+		return self.export_embedded_as(request, queryset, 'jsonl')
+	export_embedded_jsonl.short_description = _('Export embedded lists as JSON Lines')
+
+	def bulk_edit_embedded(self, request, queryset):
+		"""
+		Changelist action applying one embedded element form to the embedded
+		list of every selected object. The first post shows the form; the
+		edit runs when it comes back with "apply".
+		"""
+		if not self.has_change_permission(request):
+			raise PermissionDenied
+		opts = self.model._meta
+		changeable = [e for e in self.embedded_instances if e.has_change_permission(request)]
+		if not changeable:
+			raise PermissionDenied
+		name = request.POST.get('embedded') or changeable[0].model._meta.object_name.lower()
+		embedded = self.get_embedded_instance(name)
+		if embedded not in changeable:
+			raise PermissionDenied
+		element_form_class = embedded.get_formset(request).form
+		data = 'apply' in request.POST and request.POST or None
+		form = EmbeddedBulkEditForm(data, fields=export_fields(element_form_class))
+		element_form = element_form_class(data, prefix='element', empty_permitted=True)
+		if data is not None and form.is_valid():
+			value = dict([(field, data[element_form.add_prefix(field)])
+				for field in element_form.fields if data.get(element_form.add_prefix(field))])
+			job = self.bulk_edit_class(self, name,
+				queryset.values_list('pk', flat=True), form.cleaned_data['operation'],
+				value=value, match=form.get_match())
+			state = job.run(request)
+			self.message_user(request, _('%(name)s of %(changed)d of %(total)d %(objects)s changed, %(failed)d failed.') % {
+				'name': force_unicode(embedded.verbose_name_plural).capitalize(),
+				'changed': state['changed'],
+				'total': state['total'],
+				'objects': force_unicode(opts.verbose_name_plural),
+				'failed': len(state['failed']),
+			})
+			for pk, errors in state['failed'][:10]:
+				self.message_user(request, _('%(object)s %(pk)s: %(errors)s') % {
+					'object': force_unicode(opts.verbose_name).capitalize(),
+					'pk': pk,
+					'errors': u'; '.join([u'%s: %s' % (field, u' '.join(messages))
+						for field, messages in errors.items()]),
+				})
+			return None
+
+		context = {
+			'title': _('Bulk edit of %s') % force_unicode(embedded.verbose_name_plural),
+			'form': form,
+			'element_form': element_form,
+			'embedded_choices': [(e.model._meta.object_name.lower(), e.verbose_name_plural)
+				for e in changeable],
+			'embedded_name': name,
+			'count': queryset.count(),
+			'selected': request.POST.getlist(admin.ACTION_CHECKBOX_NAME),
+			'select_across': request.POST.get('select_across', '0'),
+			'opts': opts,
+			'app_label': opts.app_label,
+			'root_path': self.admin_site.root_path,
+			'action_checkbox_name': admin.ACTION_CHECKBOX_NAME,
+		}
+		return render_to_response(self.bulk_edit_template, context,
+			context_instance=RequestContext(request))
+	bulk_edit_embedded.short_description = _('Bulk edit embedded lists')
+
+	def _json_response(self, data, status=200):
+		return HttpResponse(simplejson.dumps(data), status=status,
+			content_type='application/json')
+
+	def request_memo(self, request, owner, name, obj=None):
+		"""
+		Returns ``owner.<name>(request, obj)``, called once per request, owner
+		and object. Without a request it is called every time.
+		"""
+		if request is None:
+			return getattr(owner, name)(request, obj)
+		memo = request.__dict__.setdefault('_embedded_memo', {})
+		key = (id(owner), name, id(obj))
+		if key not in memo:
+			memo[key] = (owner, obj, list(getattr(owner, name)(request, obj)))
+		return memo[key][2]
+
+	def get_form_data(self, request):
+		"""
+		Returns the posted data the forms of a view are bound to.
+		"""
+		return EmbeddedFormData(dict(request.POST.lists()))
+
+	def get_prefix(self, prefixes, prefix):
+		prefixes[prefix] = prefixes.get(prefix, 0) + 1
+		if prefixes[prefix] != 1:
+			prefix = "%s-%s" % (prefix, prefixes[prefix])
+		return prefix
+
+	def construct_inline_formsets(self, request, obj, instance, prefixes,
+								  data=None, files=None, save_as_new=False):
+		"""
+		Returns the formsets of the regular inlines, bound to ``data`` if
+		given.
+		"""
+		formsets = []
+		for FormSet, inline in zip(self.get_formsets(request, obj), self.inline_instances):
+			prefix = self.get_prefix(prefixes, FormSet.get_default_prefix())
+			kwargs = {}
+			if data is not None:
+				kwargs = {'data': data, 'files': files}
+				if save_as_new:
+					kwargs['save_as_new'] = True
+			formsets.append(FormSet(instance=instance, prefix=prefix,
+				queryset=inline.queryset(request), **kwargs))
+		return formsets
+
+	def construct_embedded_formsets(self, request, obj, prefixes, timings,
+									data=None, files=None, add=False):
+		"""
+		Builds the formset of every embedded admin, once, and returns the
+		(embedded, formset) pairs, the placeholders of the lazy embedded lists
+		and the read-only embedded lists.
+
+		On add the embedded lists start empty and every embedded admin the user
+		can change gets a formset; what is posted for the others is ignored.
+		Otherwise read-only lists are rendered without forms and lazy lists
+		that were not loaded (or posted) get a placeholder.
+		"""
+		embedded_pairs = []
+		lazy_embedded = []
+		readonly_embedded = []
+		timings.phase('get_embedded_formsets')
+		EmbeddedFormSets = list(self.get_embedded_formsets(request, obj))
+		timings.phase('construct_formsets')
+		for FormSet, embedded in zip(EmbeddedFormSets, self.embedded_instances):
+			prefix = self.get_prefix(prefixes, FormSet.model._meta.object_name.lower())
+			if embedded.is_readonly(request, obj):
+				if not add:
+					readonly_embedded.append(self.get_readonly_embedded(request, obj, embedded, prefix))
+				continue
+			if add:
+				kwargs = {'queryset': []}
+			else:
+				if embedded.lazy and data is None:
+					lazy_embedded.append(self.get_lazy_placeholder(embedded, prefix))
+					continue
+				kwargs = {'queryset': embedded.queryset(request, obj),
+						  'window': embedded.get_window(request, prefix, obj)}
+			if data is not None:
+				kwargs.update({'data': data, 'files': files})
+			try:
+				formset = FormSet(instance=embedded.model, prefix=prefix, **kwargs)
+			except ValidationError:
+				# lazy sections that were never loaded are not posted
+				if embedded.lazy:
+					lazy_embedded.append(self.get_lazy_placeholder(embedded, prefix))
+				continue
+			if data is not None:
+				embedded.construct_nested_formsets(request, obj, formset, data, files)
+			embedded_pairs.append((embedded, formset))
+			timings.count(prefix, formset)
+		return embedded_pairs, lazy_embedded, readonly_embedded
+
+	def get_admin_formsets(self, request, obj, form, formsets, embedded_pairs):
+		"""
+		Returns the AdminForm, the inline and embedded admin formsets and the
+		media of a change form.
+		"""
+		adminForm = admin.helpers.AdminForm(form,
+			self.request_memo(request, self, 'get_fieldsets', obj),
+			self.prepopulated_fields,
+			self.request_memo(request, self, 'get_readonly_fields', obj),
+			model_admin=self)
+		media = self.media + adminForm.media
+
+		inline_admin_formsets = []
+		for inline, formset in zip(self.inline_instances, formsets):
+			fieldsets = self.request_memo(request, inline, 'get_fieldsets', obj)
+			readonly = self.request_memo(request, inline, 'get_readonly_fields', obj)
+			inline_admin_formset = admin.helpers.InlineAdminFormSet(inline, formset,
+				fieldsets, readonly, model_admin=self)
+			inline_admin_formsets.append(inline_admin_formset)
+			media = media + inline_admin_formset.media
+
+		embedded_admin_formsets = []
+		embedded_media = {}
+		for embedded, formset in embedded_pairs:
+			fieldsets = self.request_memo(request, embedded, 'get_fieldsets', obj)
+			readonly = self.request_memo(request, embedded, 'get_readonly_fields', obj)
+			embedded_admin_formset = EmbeddedAdminFormSet(embedded, formset,
+				fieldsets, readonly, model_admin=self)
+			embedded_admin_formsets.append(embedded_admin_formset)
+			# formsets of the same class have the same media
+			if formset.__class__ not in embedded_media:
+				embedded_media[formset.__class__] = embedded_admin_formset.media
+				media = media + embedded_media[formset.__class__]
+		return adminForm, inline_admin_formsets, embedded_admin_formsets, media
+
 	@csrf_protect_m
 	@transaction.commit_on_success
 	def add_view(self, request, form_url='', extra_context=None):
@@ -192,55 +1679,42 @@ class EmbeddedAdmin(admin.ModelAdmin):
 		if not self.has_add_permission(request):
 			raise PermissionDenied
 
+		timings = self.timings_class('add_view')
+		timings.phase('prepare')
 		ModelForm = self.get_form(request)
-		formsets = []
+		prefixes = {}
 		if request.method == 'POST':
-			form = ModelForm(request.POST, request.FILES)
+			data = self.get_form_data(request)
+			form = ModelForm(data, request.FILES)
 			if form.is_valid():
 				new_object = self.save_form(request, form, change=False)
 				form_validated = True
 			else:
 				form_validated = False
 				new_object = self.model()
-			prefixes = {}
-			for FormSet, inline in zip(self.get_formsets(request), self.inline_instances):
-				prefix = FormSet.get_default_prefix()
-				prefixes[prefix] = prefixes.get(prefix, 0) + 1
-				if prefixes[prefix] != 1:
-					prefix = "%s-%s" % (prefix, prefixes[prefix])
-				formset = FormSet(data=request.POST, files=request.FILES,
-								  instance=new_object,
-								  save_as_new="_saveasnew" in request.POST,
-								  prefix=prefix, queryset=inline.queryset(request))
-				formsets.append(formset)
-
-			embedded_formsets = []
-			for FormSet, embedded in zip(self.get_embedded_formsets(request, new_object),
-									   self.embedded_instances):
-				prefix = FormSet.model._meta.object_name.lower()
-				prefixes[prefix] = prefixes.get(prefix, 0) + 1
-				if prefixes[prefix] != 1:
-					prefix = "%s-%s" % (prefix, prefixes[prefix])
-				try:
-					formset = FormSet(request.POST, request.FILES, prefix=prefix,
-									  instance=embedded.model,
-									  queryset=embedded.queryset(request))
-					embedded_formsets.append(formset) # this is only to get a complete log messaging
-				except:
-					pass
+			formsets = self.construct_inline_formsets(request, None, new_object,
+				prefixes, data, request.FILES, save_as_new="_saveasnew" in request.POST)
+			embedded_pairs = self.construct_embedded_formsets(request, new_object,
+				prefixes, timings, data, request.FILES, add=True)[0]
+			embedded_formsets = [formset for embedded, formset in embedded_pairs]
 
-			if all_valid(formsets) and all_valid(embedded_formsets) and form_validated:
+			timings.phase('all_valid')
+			if all_valid(formsets) and self.validate_embedded_formsets(request, embedded_formsets) and form_validated:
 				# we have to update embedded formsets first because we modify the new_object
+				timings.phase('save_embedded_formset')
 				for formset in embedded_formsets:
-					embedded_data = self.save_embedded_formset(formset, change=False)
-					setattr(new_object, formset.model._meta.object_name.lower(), embedded_data)
-				self.save_model(request, new_object, form, change=False)
+					self.save_embedded_formset(formset, change=False)
+				timings.phase('save_model')
+				self.embedded_backend.save(self, request, new_object, form,
+					[formset.changeset for formset in embedded_formsets], change=False)
 				form.save_m2m()
 				for formset in formsets:
 					self.save_formset(request, form, formset, change=False)
 
+				timings.phase('log')
 				self.log_addition(request, new_object)
-				return self.response_add(request, new_object)
+				return self.timed_response(request, timings,
+					self.response_add(request, new_object))
 		else:
 			# Prepare the dict of initial data from the request.
 			# We have to special-case M2Ms as a list of comma-separated PKs.
@@ -253,48 +1727,13 @@ class EmbeddedAdmin(admin.ModelAdmin):
 				if isinstance(f, models.ManyToManyField):
 					initial[k] = initial[k].split(",")
 			form = ModelForm(initial=initial)
-			prefixes = {}
-			for FormSet, inline in zip(self.get_formsets(request),
-									   self.inline_instances):
-				prefix = FormSet.get_default_prefix()
-				prefixes[prefix] = prefixes.get(prefix, 0) + 1
-				if prefixes[prefix] != 1:
-					prefix = "%s-%s" % (prefix, prefixes[prefix])
-				formset = FormSet(instance=self.model(), prefix=prefix,
-								  queryset=inline.queryset(request))
-				formsets.append(formset)
-
-			for FormSet, embedded in zip(self.get_embedded_formsets(request, ), self.embedded_instances):
-				prefix = FormSet.model._meta.object_name.lower()
-				prefixes[prefix] = prefixes.get(prefix, 0) + 1
-				if prefixes[prefix] != 1:
-					prefix = "%s-%s" % (prefix, prefixes[prefix])
-				formset = FormSet(instance=embedded.model, prefix=prefix,
-								  queryset=embedded.queryset(request))
-				formsets.append(formset)
+			formsets = self.construct_inline_formsets(request, None, self.model(), prefixes)
+			embedded_pairs = self.construct_embedded_formsets(request, None,
+				prefixes, timings, add=True)[0]
 				
-		adminForm = admin.helpers.AdminForm(form, list(self.get_fieldsets(request)),
-			self.prepopulated_fields, self.get_readonly_fields(request),
-			model_admin=self)
-		media = self.media + adminForm.media
-
-		inline_admin_formsets = []
-		for inline, formset in zip(self.inline_instances, formsets):
-			fieldsets = list(inline.get_fieldsets(request))
-			readonly = list(inline.get_readonly_fields(request))
-			inline_admin_formset = admin.helpers.InlineAdminFormSet(inline, formset,
-				fieldsets, readonly, model_admin=self)
-			inline_admin_formsets.append(inline_admin_formset)
-			media = media + inline_admin_formset.media
-
-		embedded_admin_formsets=[]
-		for embedded, formset in zip(self.embedded_instances, formsets):
-			fieldsets = list(embedded.get_fieldsets(request))
-			readonly = list(embedded.get_readonly_fields(request))
-			embedded_admin_formset = EmbeddedAdminFormSet(embedded, formset,
-				fieldsets, readonly, model_admin=self)
-			embedded_admin_formsets.append(embedded_admin_formset)
-			media = media + embedded_admin_formset.media
+		timings.phase('admin_formsets')
+		adminForm, inline_admin_formsets, embedded_admin_formsets, media = \
+			self.get_admin_formsets(request, None, form, formsets, embedded_pairs)
 
 		context = {
 			'title': _('Add %s') % force_unicode(opts.verbose_name),
@@ -304,12 +1743,15 @@ class EmbeddedAdmin(admin.ModelAdmin):
 			'media': mark_safe(media),
 			'inline_admin_formsets': inline_admin_formsets,
 			'embedded_admin_formsets': embedded_admin_formsets,
-			'errors': admin.helpers.AdminErrorList(form, formsets),
+			'errors': admin.helpers.AdminErrorList(form,
+				formsets + [formset for embedded, formset in embedded_pairs]),
 			'root_path': self.admin_site.root_path,
 			'app_label': opts.app_label,
 		}
 		context.update(extra_context or {})
-		return self.render_change_form(request, context, form_url=form_url, add=True)
+		timings.phase('render')
+		return self.timed_response(request, timings,
+			self.render_change_form(request, context, form_url=form_url, add=True))
 
 	@csrf_protect_m
 	@transaction.commit_on_success
@@ -329,101 +1771,55 @@ class EmbeddedAdmin(admin.ModelAdmin):
 		if request.method == 'POST' and "_saveasnew" in request.POST:
 			return self.add_view(request, form_url='../add/')
 
+		timings = self.timings_class('change_view')
+		timings.phase('prepare')
 		ModelForm = self.get_form(request, obj)
-		formsets = []
+		prefixes = {}
 		if request.method == 'POST':
-			form = ModelForm(request.POST, request.FILES, instance=obj)
+			data = self.get_form_data(request)
+			form = ModelForm(data, request.FILES, instance=obj)
 			if form.is_valid():
 				form_validated = True
 				new_object = self.save_form(request, form, change=True)
 			else:
 				form_validated = False
 				new_object = obj
-			prefixes = {}
-			for FormSet, inline in zip(self.get_formsets(request, new_object),
-									   self.inline_instances):
-				prefix = FormSet.get_default_prefix()
-				prefixes[prefix] = prefixes.get(prefix, 0) + 1
-				if prefixes[prefix] != 1:
-					prefix = "%s-%s" % (prefix, prefixes[prefix])
-				formset = FormSet(request.POST, request.FILES,
-								  instance=new_object, prefix=prefix,
-								  queryset=inline.queryset(request))
-
-				formsets.append(formset)
-
-			embedded_formsets=[]
-			for FormSet, embedded in zip(self.get_embedded_formsets(request, new_object),
-									   self.embedded_instances):
-				prefix = FormSet.model._meta.object_name.lower()
-				prefixes[prefix] = prefixes.get(prefix, 0) + 1
-				if prefixes[prefix] != 1:
-					prefix = "%s-%s" % (prefix, prefixes[prefix])
-				try:
-					formset = FormSet(request.POST, request.FILES, prefix=prefix,
-									  queryset=embedded.queryset(request, obj))
-
-					embedded_formsets.append(formset) # this is only to get a complete history messaging
-				except:
-					pass
+			formsets = self.construct_inline_formsets(request, new_object, new_object,
+				prefixes, data, request.FILES)
+			embedded_pairs, lazy_embedded, readonly_embedded = \
+				self.construct_embedded_formsets(request, new_object, prefixes,
+					timings, data, request.FILES)
+			embedded_formsets = [formset for embedded, formset in embedded_pairs]
 				
-			if all_valid(formsets) and all_valid(embedded_formsets) and form_validated:
+			timings.phase('all_valid')
+			if all_valid(formsets) and self.validate_embedded_formsets(request, embedded_formsets) and form_validated:
 				# we have to update embedded formsets first because we modify the new_object
+				timings.phase('save_embedded_formset')
 				for formset in embedded_formsets:
-					embedded_data = self.save_embedded_formset(formset, change=True)
-					setattr(new_object, formset.model._meta.object_name.lower(), embedded_data)				
-				self.save_model(request, new_object, form, change=True)
+					self.save_embedded_formset(formset, change=True)
+				timings.phase('save_model')
+				self.embedded_backend.save(self, request, new_object, form,
+					[formset.changeset for formset in embedded_formsets], change=True)
 				form.save_m2m()
 				for formset in formsets:
 					self.save_formset(request, form, formset, change=True)
 					
-				change_message = self.construct_change_message(request, form, formsets+embedded_formsets)
+				timings.phase('construct_change_message')
+				change_message = self.construct_change_message(request, form, formsets, embedded_formsets)
+				timings.phase('log')
 				self.log_change(request, new_object, change_message)
-				return self.response_change(request, new_object)
+				return self.timed_response(request, timings,
+					self.response_change(request, new_object))
 
 		else:
 			form = ModelForm(instance=obj)
-			prefixes = {}
-			for FormSet, inline in zip(self.get_formsets(request, obj), self.inline_instances):
-				prefix = FormSet.get_default_prefix()
-				prefixes[prefix] = prefixes.get(prefix, 0) + 1
-				if prefixes[prefix] != 1:
-					prefix = "%s-%s" % (prefix, prefixes[prefix])
-				formset = FormSet(instance=obj, prefix=prefix,
-								  queryset=inline.queryset(request))
-				formsets.append(formset)
-			
-			for FormSet, embedded in zip(self.get_embedded_formsets(request, obj), self.embedded_instances):
-				prefix = FormSet.model._meta.object_name.lower()
-				prefixes[prefix] = prefixes.get(prefix, 0) + 1
-				if prefixes[prefix] != 1:
-					prefix = "%s-%s" % (prefix, prefixes[prefix])
-				formset = FormSet(instance=embedded.model, prefix=prefix,
-								  queryset=embedded.queryset(request, obj))
-				formsets.append(formset)
+			formsets = self.construct_inline_formsets(request, obj, obj, prefixes)
+			embedded_pairs, lazy_embedded, readonly_embedded = \
+				self.construct_embedded_formsets(request, obj, prefixes, timings)
 				
-		adminForm = admin.helpers.AdminForm(form, self.get_fieldsets(request, obj),
-			self.prepopulated_fields, self.get_readonly_fields(request, obj),
-			model_admin=self)
-		media = self.media + adminForm.media
-
-		inline_admin_formsets = []
-		for inline, formset in zip(self.inline_instances, formsets):
-			fieldsets = list(inline.get_fieldsets(request, obj))
-			readonly = list(inline.get_readonly_fields(request, obj))
-			inline_admin_formset = admin.helpers.InlineAdminFormSet(inline, formset,
-				fieldsets, readonly, model_admin=self)
-			inline_admin_formsets.append(inline_admin_formset)
-			media = media + inline_admin_formset.media
-			
-		embedded_admin_formsets=[]
-		for embedded, formset in zip(self.embedded_instances, formsets):
-			fieldsets = list(embedded.get_fieldsets(request, obj))
-			readonly = list(embedded.get_readonly_fields(request, obj))
-			embedded_admin_formset = EmbeddedAdminFormSet(embedded, formset,
-				fieldsets, readonly, model_admin=self)
-			embedded_admin_formsets.append(embedded_admin_formset)
-			media = media + embedded_admin_formset.media
+		timings.phase('admin_formsets')
+		adminForm, inline_admin_formsets, embedded_admin_formsets, media = \
+			self.get_admin_formsets(request, obj, form, formsets, embedded_pairs)
 
 		context = {
 			'title': _('Change %s') % force_unicode(opts.verbose_name),
@@ -434,40 +1830,99 @@ class EmbeddedAdmin(admin.ModelAdmin):
 			'media': mark_safe(media),
 			'inline_admin_formsets': inline_admin_formsets,
 			'embedded_admin_formsets': embedded_admin_formsets,
-			'errors': admin.helpers.AdminErrorList(form, formsets),
+			'lazy_embedded': lazy_embedded,
+			'readonly_embedded': readonly_embedded,
+			'errors': admin.helpers.AdminErrorList(form,
+				formsets + [formset for embedded, formset in embedded_pairs]),
 			'root_path': self.admin_site.root_path,
 			'app_label': opts.app_label,
 		}
 		
 		context.update(extra_context or {})
-		return self.render_change_form(request, context, change=True, obj=obj)
+		timings.phase('render')
+		return self.timed_response(request, timings,
+			self.render_change_form(request, context, change=True, obj=obj))
+
+	def construct_change_message(self, request, form, formsets, embedded_formsets=None):
+		"""
+		Builds the change message of the regular inlines the way the admin
+		does, plus a summary of every embedded formset: the number of
+		elements changed, added and deleted, with their positions up to
+		change_message_limit and the fields changed.
+		"""
+		message = super(EmbeddedAdmin, self).construct_change_message(request, form, formsets)
+		summaries = [self.summarize_embedded_changes(formset)
+			for formset in embedded_formsets or () if getattr(formset, 'changeset', None)]
+		summaries = [summary for summary in summaries if summary]
+		if not summaries:
+			return message
+		if not form.changed_data and not [f for f in formsets
+				if f.new_objects or f.changed_objects or f.deleted_objects]:
+			message = u''
+		return u' '.join([force_unicode(message)] + summaries).strip()
+
+	def summarize_embedded_changes(self, formset):
+		"""
+		Returns the change message of one saved embedded formset, from its
+		EmbeddedChangeSet.
+		"""
+		changeset = formset.changeset
+		opts = formset.model._meta
+
+		def name(count):
+			return force_unicode(count == 1 and opts.verbose_name or opts.verbose_name_plural)
+
+		def positions(items):
+			limit = self.change_message_limit
+			shown = u', '.join([unicode(p) for p in items[:limit]])
+			if len(items) > limit:
+				shown = ugettext('%(positions)s and %(count)d more') % {
+					'positions': shown, 'count': len(items) - limit}
+			return shown
+
+		message = []
+		if changeset.updates:
+			fields = {}
+			for element, changed_fields in formset.changed_objects:
+				for field in changed_fields:
+					fields[field] = fields.get(field, 0) + 1
+			message.append(ugettext('Changed %(fields)s of %(count)d %(name)s at %(positions)s.') % {
+				'fields': get_text_list(['%s (%d)' % item for item in sorted(fields.items())], ugettext('and')),
+				'count': len(changeset.updates),
+				'name': name(len(changeset.updates)),
+				'positions': positions([p for p, element in changeset.updates]),
+			})
+		if changeset.appends:
+			message.append(ugettext('Added %(count)d %(name)s.') % {
+				'count': len(changeset.appends), 'name': name(len(changeset.appends))})
+		if changeset.removals:
+			message.append(ugettext('Deleted %(count)d %(name)s at %(positions)s.') % {
+				'count': len(changeset.removals),
+				'name': name(len(changeset.removals)),
+				'positions': positions(sorted(changeset.removals)),
+			})
+		return u' '.join(message)
+
+	def timed_response(self, request, timings, response):
+		"""
+		Ends the timings of a view and hands them to the timing reporter and
+		the embedded_view_timed signal.
+		"""
+		timings.finish()
+		if self.timing_reporter is not None:
+			self.timing_reporter.report(self, request, timings)
+		embedded_view_timed.send(sender=self.__class__, request=request, timings=timings)
+		if settings.DEBUG:
+			response['X-Embedded-Timings'] = timings.as_header()
+		return response
 
 	def save_embedded_formset(self, formset, change):
 		"""
 			Replace BaseModelFormSet.save_new_objects for embedded formsets
 			Don't save anything in the db, but create a new list of objects to insert in the new object
+			The counter of the list in embedded_counters is saved with it
 		"""
-		from data.models import Address, Phone, Mail, Web
-			
-		formset.changed_objects = []
-		formset.deleted_objects = []
-		formset.new_objects = []
-		
-		output_objects = []
-		
-		for form in formset.initial_forms:
-			embedded_instance = form.save(commit=False)
-			if formset.can_delete == True and form._raw_value("DELETE"):
-				formset.deleted_objects.append(embedded_instance)
-			else:
-				output_objects.append(embedded_instance)
-				if form.has_changed():
-					formset.changed_objects.append((embedded_instance, form.changed_data))
-			
-		for form in formset.extra_forms:
-			if form.has_changed() and not (formset.can_delete and form._raw_value("DELETE")): # it has new data and has not been marked for deletion
-				embedded_instance = form.save(commit=False)
-				formset.new_objects.append(embedded_instance)
-				output_objects.append(embedded_instance)
-		
-		return output_objects
\ No newline at end of file
+		result = formset.save_embedded()
+		if getattr(formset, 'changeset', None) is not None:
+			self.count_embedded(formset.changeset)
+		return result
\ No newline at end of file
@@ -0,0 +1,141 @@
+# embedded/backends.py
+from embedded.records import EmbeddedRecord
+
+class EmbeddedChangeSet(object):
+	"""
+	The minimal set of operations that turns an embedded list into its saved
+	version.
+
+	Positions refer to the list as it was read from the parent: ``updates``
+	is a list of (position, element) pairs, ``removals`` a list of positions
+	and ``appends`` the new elements, inserted before position ``insert_at``
+	(which is the length of the list unless a window was being edited).
+	``result`` is the whole saved list. ``counters`` maps fields of the
+	parent to values saved with the list, like its length. ``version`` is the
+	version of the list the change set was computed against (see
+	BaseEmbeddedFormSet.get_version), when its embedded admin is versioned.
+	"""
+	def __init__(self, field, length, updates=None, removals=None,
+				 appends=None, insert_at=None, result=None):
+		self.field = field
+		self.length = length
+		self.updates = updates or []
+		self.removals = removals or []
+		self.appends = appends or []
+		if insert_at is None:
+			insert_at = length
+		self.insert_at = insert_at
+		self.result = result
+		self.counters = {}
+		self.version = None
+
+	def __len__(self):
+		return len(self.updates) + len(self.removals) + len(self.appends)
+
+	def __nonzero__(self):
+		return len(self) > 0
+	__bool__ = __nonzero__
+
+	def __repr__(self):
+		return '<EmbeddedChangeSet %s: %d updated, %d removed, %d added>' % (
+			self.field, len(self.updates), len(self.removals), len(self.appends))
+
+	def apply(self, embedded_list):
+		"""
+		Returns a new list with the operations applied to ``embedded_list``.
+		"""
+		embedded_list = list(embedded_list)
+		for position, element in self.updates:
+			embedded_list[position] = element
+		insert_at = self.insert_at
+		for position in sorted(self.removals, reverse=True):
+			del embedded_list[position]
+			if position < self.insert_at:
+				insert_at -= 1
+		embedded_list[insert_at:insert_at] = self.appends
+		return embedded_list
+
+	def materialize(self):
+		"""
+		Turns the EmbeddedRecords of the change set into model instances.
+		Backends call it right before writing the parent. A record gets a
+		single instance, wherever it appears.
+		"""
+		instances = {}
+		def materialize(element):
+			if not isinstance(element, EmbeddedRecord):
+				return element
+			if id(element) not in instances:
+				instances[id(element)] = element.to_instance()
+			return instances[id(element)]
+		self.updates = [(position, materialize(element)) for position, element in self.updates]
+		self.appends = [materialize(element) for element in self.appends]
+		if self.result is not None:
+			self.result = [materialize(element) for element in self.result]
+
+class ReplaceBackend(object):
+	"""
+	Writes embedded changes the way the admin always did: the saved lists are
+	set on the parent and the whole document is saved through ``save_model``.
+	It can't check the ``version`` of the change sets: whatever was saved
+	after the list was read is overwritten.
+	"""
+	def save(self, model_admin, request, obj, form, changesets, change):
+		for changeset in changesets:
+			changeset.materialize()
+			setattr(obj, changeset.field, changeset.result)
+			for field, value in changeset.counters.items():
+				setattr(obj, field, value)
+		model_admin.save_model(request, obj, form, change=change)
+
+class PartialUpdateBackend(ReplaceBackend):
+	"""
+	Base class for backends able to write a change set as a partial update of
+	the parent document.
+
+	The partial path is only taken when an existing object is changed and its
+	own form has no changes, since those need the full save anyway. A
+	``form`` of None means that only the embedded lists changed, as in bulk
+	edits and imports. Note that
+	``save_model`` is not called on that path. Subclasses implement
+	``apply_changeset``, which also writes the ``counters`` of the change
+	set. When the change set has a ``version``, ``apply_changeset`` can make
+	the update conditional on the stored list still having that version and
+	raise if it doesn't, rolling back the view's transaction.
+	"""
+	def save(self, model_admin, request, obj, form, changesets, change):
+		if not change or (form is not None and form.has_changed()):
+			return super(PartialUpdateBackend, self).save(model_admin, request,
+				obj, form, changesets, change)
+		for changeset in changesets:
+			changeset.materialize()
+			if changeset:
+				self.apply_changeset(obj, changeset)
+			setattr(obj, changeset.field, changeset.result)
+			for field, value in changeset.counters.items():
+				setattr(obj, field, value)
+
+	def apply_changeset(self, obj, changeset):
+		raise NotImplementedError
+
+class RecordingBackend(PartialUpdateBackend):
+	"""
+	A stand-in partial update backend that doesn't write anything but records
+	the operations it would have sent, for tests and debugging.
+	"""
+	def __init__(self):
+		self.operations = []
+
+	def apply_changeset(self, obj, changeset):
+		if changeset.version is not None:
+			self.operations.append(('expect', obj.pk, changeset.field, None, changeset.version))
+		for position, element in changeset.updates:
+			self.operations.append(('update', obj.pk, changeset.field, position, element))
+		for position in sorted(changeset.removals, reverse=True):
+			self.operations.append(('remove', obj.pk, changeset.field, position, None))
+		for offset, element in enumerate(changeset.appends):
+			self.operations.append(('insert', obj.pk, changeset.field,
+				changeset.insert_at - len([p for p in changeset.removals
+					if p < changeset.insert_at]) + offset, element))
+		for field, value in sorted(changeset.counters.items()):
+			self.operations.append(('set', obj.pk, field, None, value))
@@ -0,0 +1,405 @@
+# embedded/benchmarks.py
+"""
+Benchmarks of the embedded admin views.
+
+A synthetic document model carrying N embedded addresses is run through
+EmbeddedAdmin.add_view and change_view, GET and POST, with an admin that
+keeps everything in memory: the document is never read from nor written to
+the database, and the change form is rendered field by field instead of
+through the admin templates. The per-phase timings come from the views' own
+instrumentation.
+
+Memory is measured three ways, since tracemalloc only exists on Python 3:
+the peak of traced memory of the request and of every phase, when
+tracemalloc is available; the growth of the peak resident set size of the
+request, run once more in a new interpreter so earlier cases don't hide it;
+and the net number of objects tracked by the garbage collector that every
+phase leaves behind. A measurement that isn't available is reported as None.
+
+With ``compact=True`` the embedded admin saves through compact records and
+drops its forms once saved (EmbeddedModelAdmin.compact_records), to compare
+both pipelines.
+
+``run_startup_benchmark`` measures what the embedded admins cost before any
+request: importing ``embedded.admin`` in a new interpreter, registering
+EmbeddedAdmins with admin sites and resolving their embedded admins.
+
+Run it with ``manage.py embedded_benchmark``.
+"""
+import gc
+import os
+import subprocess
+import sys
+import time
+
+try:
+	import resource
+except ImportError:
+	resource = None
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+
+from django.contrib.admin.helpers import AdminReadonlyField
+from django.contrib.admin.sites import AdminSite
+from django.db import models
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.utils.encoding import force_unicode
+from django.utils.functional import curry
+
+from embedded.admin import EmbeddedAdmin, TabularEmbedded
+from embedded.instrumentation import BaseTimingReporter, ViewTimings
+
+SIZES = (10, 100, 1000, 10000)
+
+class BenchmarkAddress(models.Model):
+	street = models.CharField(max_length=100)
+	city = models.CharField(max_length=100, blank=True)
+	zip_code = models.CharField(max_length=10, blank=True)
+	primary = models.BooleanField(default=False)
+
+	class Meta:
+		app_label = 'embedded'
+
+class BenchmarkDocument(models.Model):
+	name = models.CharField(max_length=100)
+
+	class Meta:
+		app_label = 'embedded'
+
+class MemoryViewTimings(ViewTimings):
+	"""
+	ViewTimings that also record the peak of traced memory of every phase,
+	when tracemalloc can reset its peak, and with ``count_objects`` the net
+	number of gc-tracked objects every phase leaves behind. Counting walks
+	all the tracked objects at every phase change, which slows the views
+	down.
+	"""
+	def __init__(self, *args, **kwargs):
+		self.count_objects = kwargs.pop('count_objects', False)
+		self.peaks = {}
+		self.objects = {}
+		self._phase_memory = 0
+		self._phase_objects = 0
+		super(MemoryViewTimings, self).__init__(*args, **kwargs)
+
+	def _close(self, now):
+		super(MemoryViewTimings, self)._close(now)
+		if self._current is not None and _can_trace_phases():
+			current, peak = tracemalloc.get_traced_memory()
+			self.peaks[self._current] = max(self.peaks.get(self._current, 0),
+				peak - self._phase_memory)
+		if _can_trace_phases():
+			tracemalloc.reset_peak()
+			self._phase_memory = tracemalloc.get_traced_memory()[0]
+		if self.count_objects:
+			objects = len(gc.get_objects())
+			if self._current is not None:
+				self.objects[self._current] = (self.objects.get(self._current, 0)
+					+ objects - self._phase_objects)
+			self._phase_objects = objects
+
+def _can_trace_phases():
+	return (tracemalloc is not None and tracemalloc.is_tracing()
+		and hasattr(tracemalloc, 'reset_peak'))
+
+class CollectingReporter(BaseTimingReporter):
+	def __init__(self):
+		self.timings = []
+
+	def report(self, model_admin, request, timings):
+		self.timings.append(timings)
+
+class BenchmarkAddressEmbedded(TabularEmbedded):
+	model = BenchmarkAddress
+	# formsets build at most max(1000, max_num) forms
+	max_num = max(SIZES)
+
+	def queryset(self, request, parent_instance=None):
+		return getattr(parent_instance, 'benchmarkaddress', [])
+
+class BenchmarkAdmin(EmbeddedAdmin):
+	"""
+	An EmbeddedAdmin that keeps the benchmark document in memory.
+	"""
+	embedded = [BenchmarkAddressEmbedded]
+	timings_class = MemoryViewTimings
+
+	def __init__(self, document, *args, **kwargs):
+		count_objects = kwargs.pop('count_objects', False)
+		compact = kwargs.pop('compact', False)
+		super(BenchmarkAdmin, self).__init__(*args, **kwargs)
+		self.document = document
+		for embedded in self.embedded_instances:
+			embedded.compact_records = compact
+		self.timings_class = curry(MemoryViewTimings, count_objects=count_objects)
+		self.timing_reporter = CollectingReporter()
+
+	def has_add_permission(self, request):
+		return True
+
+	def has_change_permission(self, request, obj=None):
+		return True
+
+	def get_object(self, request, object_id):
+		return self.document
+
+	def save_model(self, request, obj, form, change):
+		pass
+
+	def log_addition(self, request, object):
+		pass
+
+	def log_change(self, request, object, message):
+		pass
+
+	def response_add(self, request, obj, post_url_continue='../%s/'):
+		return HttpResponse('')
+
+	def response_change(self, request, obj):
+		return HttpResponse('')
+
+	def render_change_form(self, request, context, add=False, change=False, form_url='', obj=None):
+		output = []
+		for embedded_admin_formset in context['embedded_admin_formsets']:
+			output.append(force_unicode(embedded_admin_formset.formset.management_form))
+			for field in embedded_admin_formset.fields():
+				if isinstance(field, dict):
+					output.append(force_unicode(field['label']))
+				else:
+					output.append(force_unicode(field.label))
+			for admin_form in embedded_admin_formset:
+				for fieldset in admin_form:
+					for line in fieldset:
+						for field in line:
+							if isinstance(field, AdminReadonlyField):
+								output.append(force_unicode(field.contents()))
+							else:
+								output.append(force_unicode(field.field))
+		return HttpResponse(u''.join(output))
+
+class StartupAdmin(EmbeddedAdmin):
+	embedded = [BenchmarkAddressEmbedded]
+
+def make_document(size):
+	document = BenchmarkDocument(pk=1, name='Document')
+	document.benchmarkaddress = [BenchmarkAddress(street='Street %d' % i,
+		city='City %d' % (i % 50), zip_code='%05d' % i) for i in range(size)]
+	return document
+
+def make_post_data(size, change):
+	"""
+	Returns the data posted for ``size`` addresses. On change, one of them is
+	edited; on add all of them are new.
+	"""
+	data = {
+		'name': 'Document',
+		'benchmarkaddress-TOTAL_FORMS': str(size),
+		'benchmarkaddress-INITIAL_FORMS': str(change and size or 0),
+	}
+	for i in range(size):
+		prefix = 'benchmarkaddress-%d-' % i
+		data[prefix + 'street'] = 'Street %d' % i
+		data[prefix + 'city'] = 'City %d' % (i % 50)
+		data[prefix + 'zip_code'] = '%05d' % i
+	if size:
+		data['benchmarkaddress-%d-street' % (size // 2)] = 'Changed'
+	return data
+
+def make_request(view, method, size, count_objects=False, compact=False):
+	"""
+	Returns the BenchmarkAdmin and the request of one case.
+	"""
+	document = make_document(view == 'change_view' and size or 0)
+	model_admin = BenchmarkAdmin(document, BenchmarkDocument, AdminSite(),
+		count_objects=count_objects, compact=compact)
+	factory = RequestFactory()
+	if method == 'POST':
+		request = factory.post('/', make_post_data(size, view == 'change_view'))
+	else:
+		request = factory.get('/')
+	request._dont_enforce_csrf_checks = True
+	return model_admin, request
+
+def call_view(model_admin, view, request):
+	if view == 'change_view':
+		model_admin.change_view(request, '1')
+	else:
+		model_admin.add_view(request)
+
+def run_view(view, method, size, count_objects=False, compact=False):
+	"""
+	Runs one view once and returns its MemoryViewTimings and the peak of
+	traced memory of the whole request, in bytes (or None).
+	"""
+	model_admin, request = make_request(view, method, size, count_objects, compact)
+	gc.collect()
+	if tracemalloc is not None and tracemalloc.is_tracing():
+		tracemalloc.clear_traces()
+		if hasattr(tracemalloc, 'reset_peak'):
+			tracemalloc.reset_peak()
+	base = tracemalloc is not None and tracemalloc.is_tracing() and tracemalloc.get_traced_memory()[0]
+	call_view(model_admin, view, request)
+	peak = None
+	if tracemalloc is not None and tracemalloc.is_tracing():
+		peak = tracemalloc.get_traced_memory()[1] - base
+	return model_admin.timing_reporter.timings[-1], peak
+
+def max_rss_kb():
+	"""
+	Returns the peak resident set size of this process so far, in kilobytes,
+	or None without the resource module.
+
+	Linux keeps the ru_maxrss of the parent in a forked and exec'ed child,
+	so there it is read from the VmHWM line of /proc/self/status, which
+	starts over with the new program.
+	"""
+	try:
+		status = open('/proc/self/status')
+	except IOError:
+		pass
+	else:
+		try:
+			for line in status:
+				if line.startswith('VmHWM:'):
+					return int(line.split()[1])
+		finally:
+			status.close()
+	if resource is None:
+		return None
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin':
+		# bytes on Mac OS X, kilobytes elsewhere
+		rss //= 1024
+	return rss
+
+def measure_rss(view, method, size, compact=False):
+	"""
+	Runs one case and returns the growth of the peak resident set size it
+	caused, in kilobytes. Only meaningful in a new interpreter, see
+	peak_rss_kb().
+	"""
+	model_admin, request = make_request(view, method, size, compact=compact)
+	gc.collect()
+	before = max_rss_kb()
+	call_view(model_admin, view, request)
+	return max_rss_kb() - before
+
+# Prints the growth of the peak resident set size of one case.
+RSS_SCRIPT = """
+import sys
+from embedded.benchmarks import measure_rss
+print(measure_rss(sys.argv[1], sys.argv[2], int(sys.argv[3]), sys.argv[4] == 'compact'))
+"""
+
+def peak_rss_kb(view, method, size, compact=False):
+	"""
+	Returns how much one case raises the peak resident set size of a new
+	interpreter with the current settings, in kilobytes, or None without the
+	resource module. The peak of this process only ever grows, so it can't
+	tell one case from the ones run before.
+	"""
+	if resource is None:
+		return None
+	env = dict(os.environ)
+	env['PYTHONPATH'] = os.pathsep.join([path for path in sys.path if path])
+	process = subprocess.Popen([sys.executable, '-c', RSS_SCRIPT, view, method, str(size),
+		compact and 'compact' or 'full'],
+		stdout=subprocess.PIPE, env=env)
+	output = process.communicate()[0]
+	if process.returncode:
+		raise RuntimeError('Measuring %s %s with %d elements failed.' % (method, view, size))
+	return int(output)
+
+def run_benchmarks(sizes=SIZES, repeat=3, trace_memory=True, compact=False):
+	"""
+	Yields one result dict per view, method and size, keeping the fastest of
+	``repeat`` runs. With ``trace_memory`` every case also gets the memory
+	measurements described above.
+	"""
+	tracing = trace_memory and tracemalloc is not None and not tracemalloc.is_tracing()
+	if tracing:
+		tracemalloc.start()
+	try:
+		for size in sizes:
+			for view in ('add_view', 'change_view'):
+				for method in ('GET', 'POST'):
+					best = None
+					for i in range(repeat):
+						timings, peak = run_view(view, method, size, trace_memory, compact)
+						if best is None or timings.total < best[0].total:
+							best = (timings, peak)
+					timings, peak = best
+					rss = None
+					if trace_memory:
+						rss = peak_rss_kb(view, method, size, compact)
+					yield {
+						'view': view,
+						'method': method,
+						'size': size,
+						'compact': compact,
+						'total': timings.total,
+						'phases': dict(timings.items()),
+						'phase_peak_memory': timings.peaks or None,
+						'phase_objects': timings.objects or None,
+						'peak_memory': peak,
+						'peak_rss_kb': rss,
+						'rows': timings.rows,
+						'time': time.time(),
+					}
+	finally:
+		if tracing:
+			tracemalloc.stop()
+
+# Prints the seconds taken to import the Django admin and then embedded.admin.
+IMPORT_SCRIPT = """
+import time
+start = time.time()
+import django.contrib.admin
+middle = time.time()
+import embedded.admin
+print('%r %r' % (middle - start, time.time() - middle))
+"""
+
+def time_import():
+	"""
+	Returns the seconds taken to import django.contrib.admin and then
+	embedded.admin in a new interpreter with the current settings.
+	"""
+	env = dict(os.environ)
+	env['PYTHONPATH'] = os.pathsep.join([path for path in sys.path if path])
+	process = subprocess.Popen([sys.executable, '-c', IMPORT_SCRIPT],
+		stdout=subprocess.PIPE, env=env)
+	output = process.communicate()[0]
+	if process.returncode:
+		raise RuntimeError('Importing embedded.admin failed.')
+	return [float(value) for value in output.split()]
+
+def run_startup_benchmark(admins=100, repeat=3):
+	"""
+	Returns the startup costs, keeping the fastest of ``repeat`` runs: the
+	imports, the registration of ``admins`` EmbeddedAdmins, each with its own
+	admin site, and the first resolution of their embedded admins.
+	"""
+	best = {}
+	for i in range(repeat):
+		django_admin, embedded_admin = time_import()
+		sites = [AdminSite() for j in range(admins)]
+		start = time.time()
+		for site in sites:
+			site.register(BenchmarkDocument, StartupAdmin)
+		registered = time.time()
+		for site in sites:
+			site._registry[BenchmarkDocument].embedded_instances
+		resolved = time.time()
+		for key, value in (('import_django_admin', django_admin),
+				('import_embedded_admin', embedded_admin),
+				('register', registered - start),
+				('resolve', resolved - registered)):
+			best[key] = min(best.get(key, value), value)
+	best['admins'] = admins
+	best['time'] = time.time()
+	return best
@@ -0,0 +1,190 @@
+# embedded/bulk.py
+from django import forms
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.utils.encoding import force_unicode
+from django.utils.hashcompat import md5_constructor
+from django.utils.translation import ugettext_lazy as _
+
+from embedded.backends import EmbeddedChangeSet
+
+BULK_ACTIONS = (
+	('append', _('Append the element')),
+	('update', _('Set the filled in fields on the matching elements')),
+	('remove', _('Remove the matching elements')),
+)
+
+class EmbeddedBulkEditForm(forms.Form):
+	"""
+	The operation of a bulk edit. The element itself comes from the form of
+	the embedded admin.
+	"""
+	operation = forms.ChoiceField(choices=BULK_ACTIONS)
+	match_field = forms.ChoiceField(required=False)
+	match_value = forms.CharField(required=False)
+
+	def __init__(self, *args, **kwargs):
+		fields = kwargs.pop('fields')
+		super(EmbeddedBulkEditForm, self).__init__(*args, **kwargs)
+		self.fields['match_field'].choices = [('', _('Every element'))] + [
+			(name, name) for name in fields]
+
+	def get_match(self):
+		if not self.cleaned_data.get('match_field'):
+			return {}
+		return {self.cleaned_data['match_field']: self.cleaned_data['match_value']}
+
+class EmbeddedBulkEdit(object):
+	"""
+	Applies the same change to the embedded list ``name`` of every object in
+	``pks``, ``chunk_size`` objects per transaction.
+
+	``action`` is "append" (``value`` is added as a new element), "update"
+	(the fields of ``value`` are set on the elements matching ``match``) or
+	"remove" (the matching elements are removed). ``match`` maps field names
+	to the values an element must have; an empty match takes every element.
+	Changes go through ``EmbeddedAdmin.apply_embedded_operations``, so the
+	elements are validated with the form of the embedded admin.
+
+	After every chunk the progress is saved in the cache under a key made
+	from the job, so running an unfinished job again resumes after the last
+	committed chunk, retrying the objects that failed first. The checkpoint
+	is deleted when the job is done, so running a finished job again starts
+	it over.
+	"""
+	chunk_size = 100
+	checkpoint_timeout = 24 * 60 * 60
+
+	def __init__(self, model_admin, name, pks, action, value=None, match=None,
+				 chunk_size=None, cache=cache):
+		if action not in dict(BULK_ACTIONS):
+			raise ValueError('Unknown bulk action %r.' % action)
+		self.model_admin = model_admin
+		self.embedded = model_admin.get_embedded_instance(name)
+		self.name = name
+		self.pks = list(pks)
+		self.action = action
+		self.value = value or {}
+		self.match = match or {}
+		if chunk_size is not None:
+			self.chunk_size = chunk_size
+		self.cache = cache
+
+	def get_key(self):
+		job = repr((self.model_admin.model._meta.app_label,
+			self.model_admin.model._meta.object_name, self.name, self.pks,
+			self.action, sorted(self.value.items()), sorted(self.match.items())))
+		return 'embedded-bulk-%s' % md5_constructor(job).hexdigest()
+	key = property(get_key)
+
+	def checkpoint(self):
+		"""
+		Returns the saved progress of the job: the position in ``pks`` reached,
+		the number of objects changed, the (pk, errors) pairs of the failed
+		ones and whether the job is done.
+		"""
+		return self.cache.get(self.key) or {
+			'position': 0,
+			'total': len(self.pks),
+			'changed': 0,
+			'failed': [],
+			'done': False,
+		}
+
+	def matches(self, element):
+		for field, value in self.match.items():
+			if force_unicode(getattr(element, field, None)) != force_unicode(value):
+				return False
+		return True
+
+	def get_operations(self, embedded_list):
+		"""
+		Returns the operations of the change on ``embedded_list`` and the
+		positions they touch.
+		"""
+		if self.action == 'append':
+			return [{'op': 'insert', 'value': self.value}], [len(embedded_list)]
+		positions = [i for i, element in enumerate(embedded_list) if self.matches(element)]
+		if self.action == 'update':
+			return [{'op': 'replace', 'index': i, 'value': self.value} for i in positions], positions
+		return [{'op': 'remove', 'index': i} for i in reversed(positions)], positions
+
+	def apply(self, request, obj):
+		"""
+		Changes the embedded list of ``obj``. Returns the errors of the first
+		invalid operation, if any, and whether the object was saved. Objects
+		whose list the user can't change fail.
+		"""
+		try:
+			self.model_admin.check_embedded_change(request, obj, self.embedded)
+		except PermissionDenied:
+			return {'__all__': [force_unicode(_('You are not allowed to change this list.'))]}, False
+		current = list(self.embedded.get_embedded_list(request, obj))
+		operations, positions = self.get_operations(current)
+		if not operations:
+			return None, False
+		embedded_list, errors = self.model_admin.apply_embedded_operations(
+			request, obj, self.embedded, operations)
+		if errors:
+			return dict([(field, [force_unicode(message) for message in messages])
+				for field, messages in errors[0][1].items()]), False
+		field = self.embedded.model._meta.object_name.lower()
+		if self.action == 'append':
+			changeset = EmbeddedChangeSet(field, len(current),
+				appends=embedded_list[-1:], result=embedded_list)
+		elif self.action == 'update':
+			changeset = EmbeddedChangeSet(field, len(current),
+				updates=[(i, embedded_list[i]) for i in positions], result=embedded_list)
+		else:
+			changeset = EmbeddedChangeSet(field, len(current), removals=positions,
+				result=embedded_list)
+		self.model_admin.count_embedded(changeset)
+		self.model_admin.embedded_backend.save(self.model_admin, request, obj,
+			None, [changeset], change=True)
+		return None, True
+
+	def run(self, request=None, progress=None):
+		"""
+		Runs the job from its last checkpoint and returns the final one.
+		``progress`` is called with the checkpoint after every chunk.
+		"""
+		state = self.checkpoint()
+		queryset = self.model_admin.queryset(request)
+		# failed objects still waiting to be retried stay in the checkpoint
+		retry, state['failed'] = state['failed'], []
+		while retry or state['position'] < len(self.pks):
+			if retry:
+				chunk = [pk for pk, errors in retry[:self.chunk_size]]
+				retry = retry[self.chunk_size:]
+			else:
+				chunk = self.pks[state['position']:state['position'] + self.chunk_size]
+				state['position'] += len(chunk)
+			changed = []
+			failed = []
+			with transaction.commit_on_success():
+				for obj in queryset.filter(pk__in=chunk):
+					errors, saved = self.apply(request, obj)
+					if errors:
+						failed.append((obj.pk, errors))
+					elif saved:
+						changed.append(obj.pk)
+						if request is not None:
+							self.model_admin.log_change(request, obj, self.get_change_message())
+			state['changed'] += len(changed)
+			state['failed'].extend(failed)
+			state['done'] = not retry and state['position'] >= len(self.pks)
+			if state['done']:
+				self.cache.delete(self.key)
+			else:
+				self.cache.set(self.key, dict(state, failed=state['failed'] + retry),
+					self.checkpoint_timeout)
+			if progress is not None:
+				progress(state)
+		return state
+
+	def get_change_message(self):
+		return _('Bulk %(action)s of %(name)s.') % {
+			'action': self.action,
+			'name': force_unicode(self.embedded.verbose_name_plural),
+		}
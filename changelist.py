@@ -0,0 +1,104 @@
+# embedded/changelist.py
+"""
+Changelist columns summarizing embedded lists.
+
+Columns are list_display callables. Each one names the embedded lists it
+reads in ``embedded_fields``; when list_display has such columns,
+EmbeddedChangeList defers the embedded list fields none of them reads, so a
+changelist page doesn't deserialize them.
+Counts read a denormalized counter field when given one (see
+EmbeddedAdmin.embedded_counters) and need no embedded list at all.
+"""
+from django.contrib.admin.views.main import ChangeList
+from django.utils.encoding import force_unicode
+
+from embedded.helpers import embedded_elements
+
+class EmbeddedColumn(object):
+	"""
+	A list_display column over the embedded list ``name`` of the changelist
+	objects.
+	"""
+	def __init__(self, name, short_description=None):
+		self.name = name
+		self.short_description = short_description or name
+		self.embedded_fields = (name,)
+		# the admin templates and checks read it from callables
+		self.__name__ = '%s_%s' % (self.__class__.__name__.lower(), name)
+
+	def get_list(self, obj):
+		return embedded_elements(getattr(obj, self.name, None))
+
+	def __call__(self, obj):
+		raise NotImplementedError
+
+class EmbeddedCount(EmbeddedColumn):
+	"""
+	The number of elements of the embedded list, read from the ``counter``
+	field of the object when it has a value.
+	"""
+	def __init__(self, name, counter=None, short_description=None):
+		super(EmbeddedCount, self).__init__(name, short_description)
+		self.counter = counter
+		if counter is not None:
+			# objects saved before the counter existed read the list
+			self.embedded_fields = ()
+
+	def __call__(self, obj):
+		if self.counter is not None:
+			count = getattr(obj, self.counter, None)
+			if count is not None:
+				return count
+		return len(self.get_list(obj))
+
+class EmbeddedPreview(EmbeddedColumn):
+	"""
+	The first ``count`` elements of the embedded list, or their ``field``,
+	and the number of the rest.
+	"""
+	def __init__(self, name, count=3, field=None, short_description=None):
+		super(EmbeddedPreview, self).__init__(name, short_description)
+		self.count = count
+		self.field = field
+
+	def __call__(self, obj):
+		elements = self.get_list(obj)
+		values = []
+		for element in elements[:self.count]:
+			if self.field is not None:
+				element = getattr(element, self.field, None)
+			values.append(force_unicode(element))
+		preview = u', '.join(values)
+		if len(elements) > self.count:
+			preview += u' (+%d)' % (len(elements) - self.count)
+		return preview
+
+class EmbeddedAggregate(EmbeddedColumn):
+	"""
+	``function`` (sum by default) of the values of ``field`` in the
+	elements of the embedded list, leaving out empty values. None when the
+	function has no value for an empty list, like max.
+	"""
+	def __init__(self, name, field, function=sum, short_description=None):
+		super(EmbeddedAggregate, self).__init__(name, short_description)
+		self.field = field
+		self.function = function
+
+	def __call__(self, obj):
+		values = [getattr(element, self.field, None) for element in self.get_list(obj)]
+		try:
+			return self.function([value for value in values if value is not None])
+		except ValueError:
+			return None
+
+class EmbeddedChangeList(ChangeList):
+	"""
+	A ChangeList that defers the embedded list fields its columns don't
+	read.
+	"""
+	def get_query_set(self):
+		qs = super(EmbeddedChangeList, self).get_query_set()
+		deferred = self.model_admin.get_deferred_embedded(self.list_display)
+		if deferred:
+			qs = qs.defer(*deferred)
+		return qs
@@ -1,43 +1,221 @@
 # embedded/helpers.py
 from django.contrib import admin
-from django.contrib.admin.util import (flatten_fieldsets, label_for_field)
+from django.contrib.admin.helpers import (AdminField, AdminReadonlyField,
+	Fieldline, normalize_fieldsets)
+from django.contrib.admin.util import (flatten_fieldsets, label_for_field,
+	help_text_for_field, lookup_field, display_for_field)
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils.datastructures import MultiValueDict, MultiValueDictKeyError
+from django.utils.encoding import force_unicode, smart_str, smart_unicode
+from django.utils.hashcompat import md5_constructor
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
 
-class EmbeddedAdminFormSet(admin.helpers.InlineAdminFormSet):
+def embedded_elements(qs):
 	"""
-	A wrapper around an embedded formset for use in the admin system.
+	Returns the elements of an embedded list, found on its parent as a list,
+	a manager or nothing, as a tuple.
 	"""
-	def fields(self):
-		for i, field in enumerate(flatten_fieldsets(self.fieldsets)):
-			if field in self.readonly_fields:
-				yield {
-					'label': label_for_field(field, self.opts.model, self.opts),
+	if hasattr(qs, 'all'):
+		qs = qs.all()
+	return tuple(qs or ())
+
+def freeze(value):
+	"""
+	Turns lists, sets and dicts into something that can be part of a cache
+	key.
+	"""
+	if isinstance(value, (list, tuple)):
+		return tuple([freeze(v) for v in value])
+	if isinstance(value, (set, frozenset)):
+		return frozenset(value)
+	if isinstance(value, dict):
+		return tuple(sorted([(k, freeze(v)) for k, v in value.items()]))
+	return value
+
+class EmbeddedFormData(MultiValueDict):
+	"""
+	The posted data as the admin forms read it. A MultiValueDict puts its
+	whole contents in the error of a missing key, and forms look up missing
+	keys all the time (unchecked checkboxes, empty extra forms), which made
+	big posts quadratic. Here a missing key costs a dict lookup.
+	"""
+	def __getitem__(self, key):
+		try:
+			list_ = dict.__getitem__(self, key)
+		except KeyError:
+			raise MultiValueDictKeyError(key)
+		try:
+			return list_[-1]
+		except IndexError:
+			return []
+
+class EmbeddedFieldLayout(object):
+	"""
+	The field metadata of an embedded admin for a form class, fieldsets and
+	readonly fields: column headers, readonly labels and help texts, and the
+	fields of every line. It is computed once and shared by all the rows.
+	"""
+	max_layouts = 32
+
+	def __init__(self, embedded, form_class, fieldsets, readonly_fields):
+		self.fieldsets = normalize_fieldsets(fieldsets)
+		self.readonly_fields = tuple(readonly_fields)
+		model = form_class._meta.model
+		self.readonly_meta = {}
+		for field in self.readonly_fields:
+			if callable(field):
+				class_name = field.__name__ != '<lambda>' and field.__name__ or ''
+			else:
+				class_name = field
+			self.readonly_meta[field] = {
+				'name': class_name,
+				'label': label_for_field(field, model, embedded),
+				'field': field,
+				'help_text': help_text_for_field(class_name, model),
+			}
+		self.columns = []
+		for field in flatten_fieldsets(self.fieldsets):
+			if field in self.readonly_meta:
+				self.columns.append({
+					'label': self.readonly_meta[field]['label'],
 					'widget': {
 						'is_hidden': False
 					},
 					'required': False
-				}
+				})
 			else:
-				yield self.formset.form.base_fields[field]
+				self.columns.append(form_class.base_fields[field])
+		# one list of lines per fieldset: names repeat, and are often None
+		self.lines = [[hasattr(line, '__iter__') and tuple(line) or (line,)
+			for line in options.get('fields', ())] for name, options in self.fieldsets]
+
+	@classmethod
+	def for_admin(cls, embedded, form_class, fieldsets, readonly_fields):
+		"""
+		Returns the layout cached on the embedded admin, building it if needed.
+		"""
+		layouts = embedded.__dict__.setdefault('_field_layouts', {})
+		key = (form_class, freeze(fieldsets), freeze(readonly_fields))
+		try:
+			return layouts[key]
+		except KeyError:
+			if len(layouts) >= cls.max_layouts:
+				layouts.clear()
+			layout = layouts[key] = cls(embedded, form_class, fieldsets, readonly_fields)
+			return layout
+
+class EmbeddedAdminFormSet(admin.helpers.InlineAdminFormSet):
+	"""
+	A wrapper around an embedded formset for use in the admin system.
+	"""
+	def __iter__(self):
+		layout = self.layout()
+		for i, (form, original) in enumerate(zip(self.formset.initial_forms, self.formset.get_queryset())):
+			yield EmbeddedAdminForm(self.formset, form, self.fieldsets,
+				self.opts.prepopulated_fields, original, self.readonly_fields,
+				model_admin=self.opts,
+				original_content_type_id=self.original_content_type_id(),
+				layout=layout, index=i)
+		for i, form in enumerate(self.formset.extra_forms, self.formset.initial_form_count()):
+			yield EmbeddedAdminForm(self.formset, form, self.fieldsets,
+				self.opts.prepopulated_fields, None, self.readonly_fields,
+				model_admin=self.opts, layout=layout, index=i)
+		yield EmbeddedAdminForm(self.formset, self.formset.empty_form,
+			self.fieldsets, self.opts.prepopulated_fields, None,
+			self.readonly_fields, model_admin=self.opts, layout=layout)
+
+	def layout(self):
+		if not hasattr(self, '_layout'):
+			self._layout = EmbeddedFieldLayout.for_admin(self.opts,
+				self.formset.form, self.fieldsets, self.readonly_fields)
+		return self._layout
+
+	def original_content_type_id(self):
+		"""
+		Returns the content type id shared by all the embedded elements, which
+		is only used to link them to their site. It is looked up once per
+		formset, and not at all when the model has no get_absolute_url.
+		"""
+		if not hasattr(self, '_original_content_type_id'):
+			model = self.formset.model
+			if hasattr(model, 'get_absolute_url'):
+				self._original_content_type_id = ContentType.objects.get_for_model(model).pk
+			else:
+				self._original_content_type_id = None
+		return self._original_content_type_id
+
+	def fields(self):
+		return self.layout().columns
 
 class EmbeddedAdminForm(admin.helpers.InlineAdminForm):
 	"""
 	A wrapper around an embedded form for use in the admin system.
 	"""
 	def __init__(self, formset, form, fieldsets, prepopulated_fields, original,
-	  readonly_fields=None, model_admin=None):
+	  readonly_fields=None, model_admin=None, original_content_type_id=None,
+	  layout=None, index=None):
 		self.formset = formset
 		self.model_admin = model_admin
+		self.index = index
 		self.original = original
 		if original is not None:
-			self.original_content_type_id = ContentType.objects.get_for_model(original).pk
+			if original_content_type_id is None and hasattr(original, 'get_absolute_url'):
+				original_content_type_id = ContentType.objects.get_for_model(original).pk
+			self.original_content_type_id = original_content_type_id
 		self.show_url = original and hasattr(original, 'get_absolute_url')
-		super(EmbeddedAdminForm, self).__init__(form, fieldsets, prepopulated_fields,
-			readonly_fields, model_admin)
+		self.layout = layout
+		if layout is None:
+			admin.helpers.AdminForm.__init__(self, form, fieldsets, prepopulated_fields,
+				readonly_fields, model_admin)
+		else:
+			# the layout already holds the normalized fieldsets
+			self.form, self.fieldsets = form, layout.fieldsets
+			self.prepopulated_fields = [{
+				'field': form[field_name],
+				'dependencies': [form[f] for f in dependencies]
+			} for field_name, dependencies in prepopulated_fields.items()]
+			self.readonly_fields = layout.readonly_fields
 
 	def __iter__(self):
-		for name, options in self.fieldsets:
+		for i, (name, options) in enumerate(self.fieldsets):
 			yield EmbeddedFieldset(self.formset, self.form, name,
-				self.readonly_fields, model_admin=self.model_admin, **options)
+				self.readonly_fields, model_admin=self.model_admin,
+				layout=self.layout, lines=self.layout and self.layout.lines[i], **options)
+
+	def nested(self):
+		"""
+		Returns the nested embedded lists of the row, one dict per nested
+		embedded admin: the prefix of its forms, the formset if they were
+		posted and, for existing elements, the url rendering the forms when
+		the row is expanded.
+		"""
+		nested_admins = getattr(self.model_admin, 'embedded_instances', None)
+		if self.index is None or not nested_admins:
+			return []
+		posted = dict([(id(nested), formset) for nested, formset in
+			getattr(self.formset, 'nested_formsets', {}).get(self.index, ())])
+		path = getattr(self.formset, 'embedded_path', None) or self.formset.prefix
+		position = self.formset.position(self.index)
+		result = []
+		for nested in nested_admins:
+			name = nested.model._meta.object_name.lower()
+			url = None
+			if self.original is not None:
+				url = 'embedded/%s/%d/%s/' % (path, position, name)
+				if position != self.index:
+					url += '?offset=%d' % (position - self.index)
+			result.append({
+				'name': name,
+				'prefix': '%s-%s' % (self.form.prefix, name),
+				'verbose_name': nested.verbose_name_plural,
+				'template': nested.template,
+				'url': url,
+				'formset': posted.get(id(nested)),
+			})
+		return result
 
 	def has_auto_field(self):
 		if self.form._meta.model._meta.has_auto_field:
@@ -61,11 +239,142 @@ class EmbeddedAdminForm(admin.helpers.InlineAdminForm):
 
 class EmbeddedFieldset(admin.helpers.InlineFieldset):
 	def __init__(self, formset, *args, **kwargs):
-		self.formset = formset
-		super(EmbeddedFieldset, self).__init__(*args, **kwargs)
+		self.layout = kwargs.pop('layout', None)
+		self.lines = kwargs.pop('lines', None)
+		super(EmbeddedFieldset, self).__init__(formset, *args, **kwargs)
 
 	def __iter__(self):
-		for field in self.fields:
-			yield Fieldline(self.form, field, self.readonly_fields,
-				model_admin=self.model_admin)
+		if self.layout is None:
+			for field in self.fields:
+				yield Fieldline(self.form, field, self.readonly_fields,
+					model_admin=self.model_admin)
+		else:
+			for fields in self.lines:
+				yield EmbeddedFieldline(self.form, fields, self.layout,
+					model_admin=self.model_admin)
+
+class EmbeddedFieldline(Fieldline):
+	"""
+	A Fieldline taking its fields and readonly metadata from an
+	EmbeddedFieldLayout, so a row only binds its values.
+	"""
+	def __init__(self, form, fields, layout, model_admin=None):
+		self.form = form
+		self.fields = fields
+		self.layout = layout
+		self.readonly_fields = layout.readonly_fields
+		self.model_admin = model_admin
+
+	def __iter__(self):
+		for i, field in enumerate(self.fields):
+			if field in self.layout.readonly_meta:
+				yield EmbeddedReadonlyField(self.form, self.layout.readonly_meta[field],
+					is_first=(i == 0), model_admin=self.model_admin)
+			else:
+				yield AdminField(self.form, field, is_first=(i == 0))
+
+class EmbeddedReadonlyField(AdminReadonlyField):
+	"""
+	An AdminReadonlyField built from precomputed metadata.
+	"""
+	def __init__(self, form, meta, is_first, model_admin=None):
+		self.field = meta
+		self.form = form
+		self.model_admin = model_admin
+		self.is_first = is_first
+		self.is_checkbox = False
+		self.is_readonly = True
+
+
+def readonly_contents(field, obj, model_admin):
+	"""
+	Returns the escaped display value of ``field`` for ``obj``, the way
+	AdminReadonlyField.contents does for a form.
+	"""
+	from django.contrib.admin.templatetags.admin_list import _boolean_icon
+	from django.contrib.admin.views.main import EMPTY_CHANGELIST_VALUE
+	try:
+		f, attr, value = lookup_field(field, obj, model_admin)
+	except (AttributeError, ValueError, ObjectDoesNotExist):
+		result_repr = EMPTY_CHANGELIST_VALUE
+	else:
+		if f is None:
+			if getattr(attr, "boolean", False):
+				result_repr = _boolean_icon(value)
+			else:
+				result_repr = smart_unicode(value)
+				if getattr(attr, "allow_tags", False):
+					result_repr = mark_safe(result_repr)
+		elif value is None:
+			result_repr = EMPTY_CHANGELIST_VALUE
+		else:
+			result_repr = display_for_field(value, f)
+	return conditional_escape(result_repr)
+
+class ReadOnlyEmbeddedRows(object):
+	"""
+	The rows of an embedded list shown without forms, for users that can't
+	change it.
+
+	Rendered rows are cached with the configured cache backend, keyed by the
+	parent's pk, the embedded field, a hash of the element's content and the
+	active language, since labels and values are translated and localized,
+	so unchanged elements are never rendered twice.
+	"""
+	def __init__(self, embedded, parent, prefix, elements, fields, cache=None, timeout=None):
+		self.opts = embedded
+		self.parent = parent
+		self.prefix = prefix
+		self.elements = elements
+		self.fields = tuple(fields)
+		self.cache = cache
+		self.timeout = timeout
+		self.verbose_name = embedded.verbose_name
+		self.verbose_name_plural = embedded.verbose_name_plural
+		self.template = embedded.readonly_template
+
+	def headers(self):
+		if not hasattr(self, '_headers'):
+			self._headers = [label_for_field(field, self.opts.model, self.opts)
+				for field in self.fields]
+		return self._headers
+
+	def content_hash(self, element):
+		values = [(f.attname, getattr(element, f.attname, None))
+			for f in element._meta.fields]
+		return md5_constructor(smart_str(repr((self.fields, values)))).hexdigest()
+
+	def cache_key(self, element):
+		return 'embedded-row:%s:%s:%s:%s:%s' % (self.opts.model._meta,
+			smart_str(self.parent.pk), self.prefix, self.content_hash(element),
+			get_language())
+
+	def render_row(self, element):
+		return self.opts.render_readonly_row(element, zip(self.headers(),
+			[readonly_contents(field, element, self.opts) for field in self.fields]))
+
+	def rows(self):
+		if not hasattr(self, '_rows'):
+			if self.cache is None or not self.timeout:
+				self._rows = [self.render_row(element) for element in self.elements]
+			else:
+				keys = [self.cache_key(element) for element in self.elements]
+				cached = self.cache.get_many(keys)
+				missing = {}
+				self._rows = []
+				for key, element in zip(keys, self.elements):
+					if key not in cached:
+						cached[key] = missing[key] = self.render_row(element)
+					self._rows.append(mark_safe(cached[key]))
+				if missing:
+					self.cache.set_many(missing, self.timeout)
+		return self._rows
+
+	def __iter__(self):
+		return iter(self.rows())
+
+	def __len__(self):
+		return len(self.elements)
 
+	def render(self):
+		return mark_safe(u''.join([force_unicode(row) for row in self.rows()]))
@@ -0,0 +1,82 @@
+# embedded/instrumentation.py
+import logging
+import time
+
+logger = logging.getLogger('embedded.timing')
+
+class ViewTimings(object):
+	"""
+	Per-phase durations of one EmbeddedAdmin view, plus the number of rows of
+	each embedded formset.
+
+	Phases run one after another: starting a phase ends the current one. A
+	phase started several times adds up its durations.
+	"""
+	def __init__(self, view, timer=time.time):
+		self.view = view
+		self.timer = timer
+		self.durations = {}
+		self.order = []
+		self.rows = {}
+		self._current = None
+		self._started = None
+		self._created = timer()
+		self.total = None
+
+	def phase(self, name):
+		now = self.timer()
+		self._close(now)
+		if name not in self.durations:
+			self.durations[name] = 0.0
+			self.order.append(name)
+		self._current = name
+		self._started = now
+
+	def count(self, prefix, formset):
+		self.rows[prefix] = len(formset.forms)
+
+	def finish(self):
+		now = self.timer()
+		self._close(now)
+		self._current = None
+		self.total = now - self._created
+
+	def _close(self, now):
+		if self._current is not None:
+			self.durations[self._current] += now - self._started
+
+	def items(self):
+		"""
+		Returns the (phase, seconds) pairs in the order they first ran.
+		"""
+		return [(name, self.durations[name]) for name in self.order]
+
+	def as_header(self):
+		parts = ['%s=%.2fms' % (name, seconds * 1000) for name, seconds in self.items()]
+		parts.extend(['rows:%s=%d' % item for item in sorted(self.rows.items())])
+		if self.total is not None:
+			parts.append('total=%.2fms' % (self.total * 1000))
+		return '; '.join(parts)
+
+	def __repr__(self):
+		return '<ViewTimings %s: %s>' % (self.view, self.as_header())
+
+class BaseTimingReporter(object):
+	"""
+	Receives the timings of every EmbeddedAdmin view. Subclasses implement
+	``report``.
+	"""
+	def report(self, model_admin, request, timings):
+		raise NotImplementedError
+
+class LoggingReporter(BaseTimingReporter):
+	"""
+	Writes one line per view to the "embedded.timing" logger.
+	"""
+	def __init__(self, level=logging.DEBUG, logger=logger):
+		self.level = level
+		self.logger = logger
+
+	def report(self, model_admin, request, timings):
+		self.logger.log(self.level, '%s %s %s: %s', timings.view,
+			model_admin.model._meta, request.path, timings.as_header())
@@ -0,0 +1,49 @@
+# embedded/management/commands/embedded_benchmark.py
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import simplejson
+
+from embedded.benchmarks import SIZES, run_benchmarks, run_startup_benchmark
+
+class Command(BaseCommand):
+	help = ('Benchmarks the embedded admin views with 10 to 10,000 embedded '
+		'elements and prints one JSON object per view, method and size.')
+	option_list = BaseCommand.option_list + (
+		make_option('--sizes', dest='sizes', default=','.join([str(s) for s in SIZES]),
+			help='Comma separated numbers of embedded elements.'),
+		make_option('--repeat', dest='repeat', type='int', default=3,
+			help='Runs of every case; the fastest one is kept.'),
+		make_option('--no-memory', action='store_false', dest='trace_memory', default=True,
+			help="Don't measure memory, which slows the views down and runs every case once more in a new interpreter."),
+		make_option('--compact', action='store_true', dest='compact', default=False,
+			help='Save the embedded elements through compact records.'),
+		make_option('--startup', action='store_true', dest='startup', default=False,
+			help='Benchmark importing embedded.admin and registering EmbeddedAdmins instead.'),
+		make_option('--admins', dest='admins', type='int', default=100,
+			help='EmbeddedAdmins registered by --startup.'),
+		make_option('--output', dest='output', default=None,
+			help='Write the results to this file instead of stdout.'),
+	)
+
+	def handle(self, *args, **options):
+		try:
+			sizes = [int(size) for size in options['sizes'].split(',')]
+		except ValueError:
+			raise CommandError('--sizes must be a list of numbers.')
+		if options['output']:
+			stream = open(options['output'], 'w')
+		else:
+			stream = self.stdout
+		try:
+			if options['startup']:
+				result = run_startup_benchmark(options['admins'], options['repeat'])
+				stream.write(simplejson.dumps(result, sort_keys=True) + '\n')
+				return
+			for result in run_benchmarks(sizes, options['repeat'],
+					options['trace_memory'], options['compact']):
+				stream.write(simplejson.dumps(result, sort_keys=True) + '\n')
+				stream.flush()
+		finally:
+			if options['output']:
+				stream.close()
@@ -0,0 +1,93 @@
+# embedded/management/commands/embedded_io.py
+import sys
+from optparse import make_option
+
+from django.contrib import admin
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import get_model
+from django.http import Http404
+
+from embedded.admin import EmbeddedAdmin
+from embedded.transfer import CHUNK_SIZE, FORMATS, EmbeddedImportError, read_rows
+
+class Command(BaseCommand):
+	args = '<export|import> <app_label.Model> <pk> <embedded> [file]'
+	help = ('Streams one embedded list of an object to or from a CSV or JSON '
+		'Lines file (stdin/stdout by default). The embedded list is the one of '
+		'the EmbeddedAdmin registered for the model in the admin site.')
+	option_list = BaseCommand.option_list + (
+		make_option('--format', dest='format', default='csv',
+			help='csv or jsonl.'),
+		make_option('--mode', dest='mode', default='append',
+			help='On import, append to or replace the current elements.'),
+		make_option('--chunk-size', dest='chunk_size', type='int', default=CHUNK_SIZE,
+			help='Rows validated at a time on import.'),
+	)
+
+	def handle(self, *args, **options):
+		if len(args) not in (4, 5) or args[0] not in ('export', 'import'):
+			raise CommandError('Usage: %s' % self.args)
+		if options['format'] not in FORMATS:
+			raise CommandError('--format must be one of %s.' % ', '.join(FORMATS))
+		action, label, pk, name = args[:4]
+		path = len(args) == 5 and args[4] or None
+
+		model_admin = self.get_model_admin(label)
+		try:
+			obj = model_admin.model._default_manager.get(pk=pk)
+		except model_admin.model.DoesNotExist:
+			raise CommandError('%s %s does not exist.' % (label, pk))
+		try:
+			embedded = model_admin.get_embedded_instance(name)
+		except Http404:
+			raise CommandError('%s has no embedded list %r.' % (label, name))
+
+		if action == 'export':
+			stream = path and open(path, 'w') or self.stdout
+			try:
+				for line in model_admin.export_embedded(None, obj, embedded, options['format']):
+					stream.write(line)
+			finally:
+				if path:
+					stream.close()
+		else:
+			stream = path and open(path, 'rb') or sys.stdin
+			try:
+				changeset = self.import_rows(model_admin, obj, embedded,
+					read_rows(options['format'], stream), options)
+			finally:
+				if path:
+					stream.close()
+			self.stderr.write('Imported %d elements, %d in the list.\n' % (
+				len(changeset.appends), len(changeset.result)))
+
+	def get_model_admin(self, label):
+		try:
+			app_label, model_name = label.split('.')
+		except ValueError:
+			raise CommandError('The model must be given as app_label.Model.')
+		model = get_model(app_label, model_name)
+		if model is None:
+			raise CommandError('Unknown model %s.' % label)
+		admin.autodiscover()
+		model_admin = admin.site._registry.get(model)
+		if not isinstance(model_admin, EmbeddedAdmin):
+			raise CommandError('%s is not registered with an EmbeddedAdmin.' % label)
+		return model_admin
+
+	@transaction.commit_on_success
+	def import_rows(self, model_admin, obj, embedded, rows, options):
+		def progress(read):
+			if int(options.get('verbosity', 1)) > 1:
+				self.stderr.write('%d rows read\n' % read)
+		try:
+			return model_admin.import_embedded(None, obj, embedded, rows,
+				mode=options['mode'], chunk_size=options['chunk_size'],
+				progress=progress)
+		except ValueError as e:
+			raise CommandError(e)
+		except EmbeddedImportError as e:
+			raise CommandError('\n'.join(['Row %d: %s' % (number, '; '.join(
+				['%s: %s' % (field, ' '.join(messages)) for field, messages in errors.items()]))
+				for number, errors in e.errors]))
@@ -1,7 +1,7 @@
 from django.db import models
 from django.forms.models import modelformset_factory, ModelForm
 
-from embedded.admin import BaseEmbeddedFormSet
+from embedded.admin import BaseEmbeddedFormSet, formset_cache
 
 class EmbeddedField():
 	field = ''
@@ -11,8 +11,15 @@ class EmbeddedField():
 	extra = 1
 	can_delete = True
 	verbose_name = ''
+	formset_cache = formset_cache
 	
 	def get_formset(self):
+		if self.formset_cache is None:
+			return self._build_formset()
+		key = (self, self.model, self.form, self.max_num, self.extra, self.can_delete, self.verbose_name)
+		return self.formset_cache.get(key, self._build_formset)
+		
+	def _build_formset(self):
 		FormSet = modelformset_factory(self.model, formset=BaseEmbeddedFormSet, form=self.form, max_num=self.max_num, extra=self.extra, can_delete=self.can_delete)
 		FormSet.verbose_name = self.verbose_name
 		return FormSet
@@ -0,0 +1,67 @@
+# embedded/records.py
+from django.utils.encoding import force_unicode
+
+_record_classes = {}
+
+class EmbeddedRecord(object):
+	"""
+	A compact stand-in for an embedded model instance while it goes through
+	the admin: one slot per field, in the model's field order, and nothing
+	else. ``to_instance`` builds the model instance back.
+
+	Use ``record_class(model)`` to get the record class of a model.
+	"""
+	__slots__ = ()
+	model = None
+
+	def __init__(self, *values):
+		for name, value in zip(self.__slots__, values):
+			setattr(self, name, value)
+
+	@classmethod
+	def from_instance(cls, instance):
+		return cls(*[getattr(instance, name) for name in cls.__slots__])
+
+	def to_instance(self):
+		return self.model(**dict(self.items()))
+
+	def items(self):
+		return [(name, getattr(self, name)) for name in self.__slots__]
+
+	def __iter__(self):
+		for name in self.__slots__:
+			yield getattr(self, name)
+
+	def __eq__(self, other):
+		return (isinstance(other, EmbeddedRecord) and self.model is other.model
+			and tuple(self) == tuple(other))
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __unicode__(self):
+		return force_unicode(self.to_instance())
+
+	def __str__(self):
+		return str(self.to_instance())
+
+	def __repr__(self):
+		return '<%s record: %r>' % (self.model._meta.object_name, tuple(self))
+
+def record_class(model):
+	"""
+	Returns the EmbeddedRecord subclass of ``model``, creating it the first
+	time.
+	"""
+	try:
+		return _record_classes[model]
+	except KeyError:
+		attrs = {
+			'__slots__': tuple([f.attname for f in model._meta.fields]),
+			'model': model,
+			# for code that only reads the options, like change messages
+			'_meta': model._meta,
+		}
+		cls = _record_classes[model] = type('%sRecord' % model._meta.object_name,
+			(EmbeddedRecord,), attrs)
+		return cls
@@ -0,0 +1,6 @@
+# embedded/signals.py
+from django.dispatch import Signal
+
+# Sent at the end of EmbeddedAdmin.add_view/change_view with the ViewTimings
+# of the request.
+embedded_view_timed = Signal(providing_args=['request', 'timings'])
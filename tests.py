@@ -5,7 +5,62 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import threading
+import time
+
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import get_cache
+from django.core.exceptions import PermissionDenied
+from django.db import models
+from django.http import HttpResponse
+from django.template.loader import render_to_string
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import simplejson, translation
+from django.utils.encoding import force_unicode
+
+from embedded.admin import (BaseEmbeddedFormSet, EmbeddedAdmin,
+    FormSetCache, TabularEmbedded)
+from embedded.backends import EmbeddedChangeSet, RecordingBackend, ReplaceBackend
+from embedded.benchmarks import run_benchmarks, run_startup_benchmark
+from embedded.bulk import EmbeddedBulkEdit
+from embedded.changelist import (EmbeddedAggregate, EmbeddedCount,
+    EmbeddedPreview)
+from embedded.helpers import (EmbeddedAdminFormSet, EmbeddedFormData,
+    ReadOnlyEmbeddedRows)
+from embedded.instrumentation import ViewTimings
+from embedded.records import EmbeddedRecord
+from embedded.signals import embedded_view_timed
+from embedded.transfer import EmbeddedImportError, read_rows
+
+
+class Address(models.Model):
+    street = models.CharField(max_length=100)
+    city = models.CharField(max_length=100, blank=True)
+
+    class Meta:
+        app_label = 'embedded'
+
+
+class Customer(models.Model):
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        app_label = 'embedded'
+
+
+class AddressEmbedded(TabularEmbedded):
+    model = Address
+    formset = BaseEmbeddedFormSet
+
+
+class CustomerAdmin(EmbeddedAdmin):
+    embedded = [AddressEmbedded]
 
 
 class SimpleTest(TestCase):
@@ -14,3 +69,1392 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class FormSetCacheTest(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        self.embedded = AddressEmbedded(Customer, AdminSite())
+        self.embedded.formset_cache = FormSetCache(max_size=2)
+
+    def test_reuses_formset_class(self):
+        FormSet = self.embedded.get_formset(self.request)
+        self.assertTrue(self.embedded.get_formset(self.request) is FormSet)
+        self.assertEqual(self.embedded.formset_cache.stats()['hits'], 1)
+        self.assertEqual(self.embedded.formset_cache.stats()['misses'], 1)
+
+    def test_key_depends_on_shape(self):
+        FormSet = self.embedded.get_formset(self.request)
+        self.assertFalse(self.embedded.get_formset(self.request, extra=5) is FormSet)
+
+    def test_explicit_callback_bypasses_cache(self):
+        self.embedded.get_formset(self.request,
+            formfield_callback=lambda f, **kwargs: f.formfield())
+        self.assertEqual(len(self.embedded.formset_cache), 0)
+
+    def test_lru_eviction(self):
+        FormSet = self.embedded.get_formset(self.request)
+        self.embedded.get_formset(self.request, extra=5)
+        self.embedded.get_formset(self.request)
+        self.embedded.get_formset(self.request, extra=6)
+        self.assertEqual(len(self.embedded.formset_cache), 2)
+        self.assertTrue(self.embedded.get_formset(self.request) is FormSet)
+
+    def test_invalidate(self):
+        FormSet = self.embedded.get_formset(self.request)
+        self.embedded.invalidate_formset_cache()
+        self.assertFalse(self.embedded.get_formset(self.request) is FormSet)
+
+
+class UserAddressEmbedded(AddressEmbedded):
+    def formfield_for_dbfield(self, db_field, **kwargs):
+        request = kwargs['request']
+        field = super(UserAddressEmbedded, self).formfield_for_dbfield(db_field, **kwargs)
+        if field is not None:
+            field.help_text = u'Edited by %s' % request.user.username
+        return field
+
+
+class UserKeyedAddressEmbedded(UserAddressEmbedded):
+    def get_formset_cache_key(self, request, obj=None):
+        return (request.user.pk,)
+
+
+class FormSetCacheKeyTest(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', 'alice@example.com', 'alice')
+        self.bob = User.objects.create_user('bob', 'bob@example.com', 'bob')
+
+    def request_for(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return request
+
+    def help_text(self, embedded, user):
+        FormSet = embedded.get_formset(self.request_for(user))
+        return FormSet.form.base_fields['street'].help_text
+
+    def test_related_add_permission_is_part_of_the_key(self):
+        site = AdminSite()
+        site.register(Tag, AliceTagAdmin)
+        embedded = TaggedAddressEmbedded(Customer, site)
+        embedded.formset_cache = FormSetCache()
+        for user, can_add in ((self.alice, True), (self.bob, False), (self.alice, True)):
+            FormSet = embedded.get_formset(self.request_for(user))
+            self.assertEqual(FormSet.form.base_fields['tag'].widget.can_add_related, can_add)
+        self.assertEqual(embedded.formset_cache.stats()['hits'], 1)
+
+    def test_overridden_formfield_hook_isnt_cached(self):
+        embedded = UserAddressEmbedded(Customer, AdminSite())
+        embedded.formset_cache = FormSetCache()
+        self.assertEqual(self.help_text(embedded, self.alice), u'Edited by alice')
+        self.assertEqual(self.help_text(embedded, self.bob), u'Edited by bob')
+        self.assertEqual(len(embedded.formset_cache), 0)
+
+    def test_cached_per_key(self):
+        embedded = UserKeyedAddressEmbedded(Customer, AdminSite())
+        embedded.formset_cache = FormSetCache()
+        self.assertEqual(self.help_text(embedded, self.alice), u'Edited by alice')
+        self.assertEqual(self.help_text(embedded, self.bob), u'Edited by bob')
+        self.assertEqual(self.help_text(embedded, self.alice), u'Edited by alice')
+        self.assertEqual(embedded.formset_cache.stats()['hits'], 1)
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        app_label = 'embedded'
+
+
+class TaggedAddress(models.Model):
+    street = models.CharField(max_length=100)
+    tag = models.ForeignKey(Tag, null=True, blank=True)
+
+    class Meta:
+        app_label = 'embedded'
+
+
+class AliceTagAdmin(admin.ModelAdmin):
+    def has_add_permission(self, request):
+        return request.user.username == 'alice'
+
+
+class TaggedAddressEmbedded(TabularEmbedded):
+    model = TaggedAddress
+
+
+class CountingList(list):
+    reads = 0
+
+    def __iter__(self):
+        self.reads += 1
+        return super(CountingList, self).__iter__()
+
+    def __getitem__(self, index):
+        self.reads += 1
+        return super(CountingList, self).__getitem__(index)
+
+
+class EmbeddedFormSetTest(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get('/')
+        self.embedded = AddressEmbedded(Customer, AdminSite())
+
+    def test_embedded_list_is_read_once(self):
+        originals = [Address(street='Street %d' % i) for i in range(20)]
+        addresses = CountingList(originals)
+        FormSet = self.embedded.get_formset(self.request)
+        formset = FormSet(prefix='address', queryset=addresses)
+        self.assertEqual(formset.initial_form_count(), 20)
+        self.assertEqual([f.instance for f in formset.initial_forms], originals)
+        self.assertEqual(addresses.reads, 1)
+
+    def test_window_merges_untouched_elements(self):
+        addresses = [Address(street='Street %d' % i) for i in range(6)]
+        FormSet = self.embedded.get_formset(self.request)
+        data = {
+            'address-TOTAL_FORMS': '3',
+            'address-INITIAL_FORMS': '2',
+            'address-0-street': 'Changed 2',
+            'address-1-street': 'Street 3',
+            'address-1-DELETE': 'on',
+            'address-2-street': 'New',
+        }
+        formset = FormSet(data, prefix='address', queryset=addresses, window=(2, 4))
+        self.assertEqual(len(formset.initial_forms), 2)
+        self.assertTrue(formset.is_valid())
+        saved = formset.save_embedded()
+        self.assertEqual([a.street for a in saved],
+            ['Street 0', 'Street 1', 'Changed 2', 'New', 'Street 4', 'Street 5'])
+        changeset = formset.changeset
+        self.assertEqual([(p, a.street) for p, a in changeset.updates], [(2, 'Changed 2')])
+        self.assertEqual(changeset.removals, [3])
+        self.assertEqual(changeset.insert_at, 4)
+        self.assertEqual(changeset.apply(addresses), saved)
+
+
+class UnchangedForm(object):
+    changed_data = []
+
+    def has_changed(self):
+        return False
+
+
+class BackendTest(TestCase):
+    def test_recording_backend_writes_only_the_changes(self):
+        addresses = [Address(street='Street %d' % i) for i in range(4)]
+        customer = Customer(pk=1, name='Customer')
+        customer.address = addresses
+        data = {
+            'address-TOTAL_FORMS': '5',
+            'address-INITIAL_FORMS': '4',
+            'address-0-street': 'Street 0',
+            'address-1-street': 'Changed 1',
+            'address-2-street': 'Street 2',
+            'address-2-DELETE': 'on',
+            'address-3-street': 'Street 3',
+            'address-4-street': 'New',
+        }
+        embedded = AddressEmbedded(Customer, AdminSite())
+        FormSet = embedded.get_formset(RequestFactory().get('/'))
+        formset = FormSet(data, prefix='address', queryset=customer.address)
+        self.assertTrue(formset.is_valid())
+        formset.save_embedded()
+        backend = RecordingBackend()
+        backend.save(CustomerAdmin(Customer, AdminSite()), None, customer,
+            UnchangedForm(), [formset.changeset], change=True)
+        self.assertEqual([op[:4] for op in backend.operations], [
+            ('update', 1, 'address', 1),
+            ('remove', 1, 'address', 2),
+            ('insert', 1, 'address', 3),
+        ])
+        self.assertEqual([a.street for a in customer.address],
+            ['Street 0', 'Changed 1', 'Street 3', 'New'])
+
+    def test_no_form_takes_the_partial_path(self):
+        customer = Customer(pk=1, name='Customer')
+        customer.address = [Address(street='Street 0')]
+        changeset = EmbeddedChangeSet('address', 1, removals=[0], result=[])
+        backend = RecordingBackend()
+        backend.save(SavingCustomerAdmin(Customer, AdminSite()), None, customer,
+            None, [changeset], change=True)
+        self.assertEqual([op[:4] for op in backend.operations], [('remove', 1, 'address', 0)])
+        self.assertEqual(customer.address, [])
+        self.assertEqual(customer.pk, 1)
+        self.assertRaises(Customer.DoesNotExist, Customer.objects.get, pk=1)
+
+
+class SavingCustomerAdmin(CustomerAdmin):
+    def save_model(self, request, obj, form, change):
+        obj.save()
+
+
+class SuperUser(object):
+    is_active = True
+    is_staff = True
+
+    def has_perm(self, perm):
+        return True
+
+    def get_and_delete_messages(self):
+        return []
+
+
+class LazyAddressEmbedded(AddressEmbedded):
+    lazy = True
+    template = 'admin/edit_inline/tabular.html'
+
+
+class LazyCustomerAdmin(CustomerAdmin):
+    embedded = [LazyAddressEmbedded]
+
+    def get_object(self, request, object_id):
+        customer = Customer(pk=1, name='Customer')
+        customer.address = [Address(street='Street %d' % i) for i in range(10)]
+        return customer
+
+
+class LazyEmbeddedTest(TestCase):
+    def test_embedded_view_renders_a_window(self):
+        request = RequestFactory().get('/1/embedded/address/',
+            {'offset': '4', 'limit': '3'})
+        request.user = SuperUser()
+        customer_admin = LazyCustomerAdmin(Customer, AdminSite())
+        response = customer_admin.embedded_view(request, '1', 'address')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'value="Street 4"')
+        self.assertContains(response, 'value="Street 6"')
+        self.assertNotContains(response, 'value="Street 7"')
+        self.assertContains(response, 'name="address-OFFSET" value="4"')
+
+    def test_window_comes_back_with_the_post(self):
+        request = RequestFactory().post('/1/', {
+            'address-OFFSET': '4', 'address-INITIAL_FORMS': '3'})
+        embedded = LazyAddressEmbedded(Customer, AdminSite())
+        self.assertEqual(embedded.get_window(request, 'address'), (4, 7))
+
+
+class PatchEmbeddedTest(TestCase):
+    def setUp(self):
+        self.customer_admin = LazyCustomerAdmin(Customer, AdminSite())
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def patch(self, operations):
+        request = RequestFactory().post('/1/embedded/address/patch/',
+            simplejson.dumps(operations), content_type='application/json')
+        request.user = self.user
+        request._dont_enforce_csrf_checks = True
+        return self.customer_admin.embedded_patch_view(request, '1', 'address')
+
+    def test_operations(self):
+        customer = Customer(pk=1, name='Customer')
+        customer.address = [Address(street='Street %d' % i) for i in range(4)]
+        embedded_list, errors = self.customer_admin.apply_embedded_operations(
+            None, customer, self.customer_admin.embedded_instances[0], [
+                {'op': 'replace', 'index': 0, 'value': {'city': 'Madrid'}},
+                {'op': 'remove', 'index': 1},
+                {'op': 'insert', 'index': 1, 'value': {'street': 'New'}},
+                {'op': 'move', 'from': 3, 'index': 0},
+            ])
+        self.assertEqual(errors, [])
+        self.assertEqual([a.street for a in embedded_list],
+            ['Street 3', 'Street 0', 'New', 'Street 2'])
+        self.assertEqual(embedded_list[1].city, 'Madrid')
+        self.assertEqual(customer.address[0].city, '')
+
+    def test_invalid_indexes_are_rejected(self):
+        customer = Customer(pk=1, name='Customer')
+        customer.address = [Address(street='Street %d' % i) for i in range(2)]
+        embedded_list, errors = self.customer_admin.apply_embedded_operations(
+            None, customer, self.customer_admin.embedded_instances[0], [
+                {'op': 'remove', 'index': True},
+                {'op': 'move', 'from': False, 'index': 1},
+                {'op': 'move', 'from': -1, 'index': 0},
+                {'op': 'move', 'from': 2, 'index': 0},
+                {'op': 'move', 'from': '1', 'index': 0},
+                {'op': 'move', 'from': 1, 'index': 2},
+                {'op': 'insert', 'index': 3, 'value': {'street': 'New'}},
+            ])
+        self.assertEqual([i for i, e in errors], range(7))
+        self.assertEqual([a.street for a in embedded_list], ['Street 0', 'Street 1'])
+
+    def test_only_posts_are_allowed(self):
+        request = RequestFactory().get('/1/embedded/address/patch/')
+        request.user = self.user
+        for view in (self.customer_admin.embedded_patch_view,
+                     self.customer_admin.embedded_import_view):
+            response = view(request, '1', 'address')
+            self.assertEqual(response.status_code, 405)
+            self.assertEqual(response['Allow'], 'POST')
+
+    def test_invalid_element_is_rejected(self):
+        response = self.patch([
+            {'op': 'replace', 'index': 0, 'value': {'street': 'Changed'}},
+            {'op': 'insert', 'value': {'city': 'No street'}},
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = simplejson.loads(response.content)['errors']
+        self.assertEqual([e['operation'] for e in errors], [1])
+        self.assertTrue('street' in errors[0]['errors'])
+
+    def test_saves_through_save_model(self):
+        response = self.patch([{'op': 'remove', 'index': 0}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(simplejson.loads(response.content), {'length': 9})
+        self.assertEqual(Customer.objects.get(pk=1).name, 'Customer')
+
+
+class Phone(models.Model):
+    number = models.CharField(max_length=20)
+
+    class Meta:
+        app_label = 'embedded'
+
+
+class Contact(models.Model):
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        app_label = 'embedded'
+
+
+class PhoneEmbedded(TabularEmbedded):
+    model = Phone
+    template = 'admin/edit_inline/tabular.html'
+
+
+class ContactEmbedded(TabularEmbedded):
+    model = Contact
+    embedded = [PhoneEmbedded]
+    template = 'admin/edit_inline/tabular.html'
+
+
+class ContactCustomerAdmin(EmbeddedAdmin):
+    embedded = [ContactEmbedded]
+
+    def get_object(self, request, object_id):
+        customer = Customer(pk=1, name='Customer')
+        customer.contact = []
+        for i in range(3):
+            contact = Contact(name='Contact %d' % i)
+            contact.phone = [Phone(number='%d-%d' % (i, j)) for j in range(2)]
+            customer.contact.append(contact)
+        self.contacts = list(customer.contact)
+        return customer
+
+    def save_model(self, request, obj, form, change):
+        self.saved = obj
+
+    def log_change(self, request, object, message):
+        self.change_message = message
+
+    def response_change(self, request, obj):
+        return HttpResponse('')
+
+    def render_change_form(self, request, context, **kwargs):
+        self.context = context
+        return HttpResponse('')
+
+
+class NestedEmbeddedTest(TestCase):
+    def setUp(self):
+        self.customer_admin = ContactCustomerAdmin(Customer, AdminSite())
+
+    def post(self, **nested):
+        data = {
+            'name': 'Customer',
+            'contact-TOTAL_FORMS': '3',
+            'contact-INITIAL_FORMS': '3',
+        }
+        for i in range(3):
+            data['contact-%d-name' % i] = 'Contact %d' % i
+        data.update(nested)
+        request = RequestFactory().post('/1/', data)
+        request.user = SuperUser()
+        request._dont_enforce_csrf_checks = True
+        return self.customer_admin.change_view(request, '1')
+
+    def test_expanded_row_is_saved_with_its_element(self):
+        self.post(**{
+            'contact-1-phone-TOTAL_FORMS': '3',
+            'contact-1-phone-INITIAL_FORMS': '2',
+            'contact-1-phone-0-number': '1-0',
+            'contact-1-phone-1-number': 'Changed',
+            'contact-1-phone-2-number': 'New',
+        })
+        original = self.customer_admin.contacts
+        saved = self.customer_admin.saved.contact
+        self.assertEqual([p.number for p in saved[1].phone], ['1-0', 'Changed', 'New'])
+        self.assertFalse(saved[1] is original[1])
+        self.assertEqual(len(original[1].phone), 2)
+        self.assertTrue(saved[0] is original[0])
+        self.assertTrue(saved[2] is original[2])
+        self.assertTrue('phone' in self.customer_admin.change_message)
+
+    def test_only_expanded_rows_get_nested_forms(self):
+        self.post(**{
+            'contact-2-phone-TOTAL_FORMS': '2',
+            'contact-2-phone-INITIAL_FORMS': '2',
+            'contact-2-phone-0-number': '',
+            'contact-2-phone-1-number': '2-1',
+        })
+        self.assertFalse(hasattr(self.customer_admin, 'saved'))
+        embedded_admin_formset = self.customer_admin.context['embedded_admin_formsets'][0]
+        self.assertEqual(embedded_admin_formset.formset.nested_formsets.keys(), [2])
+        rows = [admin_form.nested()[0] for admin_form in list(embedded_admin_formset)[:3]]
+        self.assertEqual([row['formset'] is not None for row in rows], [False, False, True])
+        self.assertTrue(rows[2]['formset'].errors[0])
+        self.assertEqual(rows[0]['url'], 'embedded/contact/0/phone/')
+        self.assertEqual(rows[2]['prefix'], 'contact-2-phone')
+
+    def test_nested_view_renders_the_expanded_row(self):
+        request = RequestFactory().get('/1/embedded/contact/2/phone/')
+        request.user = SuperUser()
+        response = self.customer_admin.embedded_nested_view(request, '1',
+            'contact', '2/phone/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'name="contact-2-phone-1-number"')
+        self.assertContains(response, 'value="2-1"')
+        self.assertNotContains(response, 'value="1-1"')
+
+
+class SearchAddressEmbedded(AddressEmbedded):
+    list_filter = ('city',)
+
+
+class SearchCustomerAdmin(ContactCustomerAdmin):
+    embedded = [SearchAddressEmbedded]
+
+    def get_object(self, request, object_id):
+        customer = Customer(pk=1, name='Customer')
+        customer.address = [Address(street='Street %d' % i, city=i % 2 and 'Odd' or 'Even')
+            for i in range(10)]
+        return customer
+
+
+class EmbeddedSearchTest(TestCase):
+    def setUp(self):
+        self.customer_admin = SearchCustomerAdmin(Customer, AdminSite())
+        self.embedded = self.customer_admin.embedded_instances[0]
+
+    def test_search_and_filter(self):
+        customer = self.customer_admin.get_object(None, '1')
+        self.assertEqual(self.embedded.search_embedded(None, customer, ['street', '1'], {}), [1])
+        self.assertEqual(self.embedded.search_embedded(None, customer, [], {'city': 'Odd'}),
+            [1, 3, 5, 7, 9])
+        customer.address[4].street = 'Street 14'
+        self.assertEqual(self.embedded.search_embedded(None, customer, ['1'], {'city': 'Even'}),
+            [4])
+
+    def test_only_matches_get_forms(self):
+        request = RequestFactory().get('/1/', {'address-q': 'street', 'address-city': 'Odd'})
+        request.user = SuperUser()
+        self.customer_admin.change_view(request, '1')
+        formset = self.customer_admin.context['embedded_admin_formsets'][0].formset
+        self.assertEqual([form.instance.street for form in formset.initial_forms],
+            ['Street 1', 'Street 3', 'Street 5', 'Street 7', 'Street 9'])
+        self.assertEqual(formset.management_form['POSITIONS'].value(), '1,3,5,7,9')
+
+    def test_save_merges_by_position(self):
+        request = RequestFactory().post('/1/', {
+            'name': 'Customer',
+            'address-TOTAL_FORMS': '3',
+            'address-INITIAL_FORMS': '2',
+            'address-POSITIONS': '3,7',
+            'address-0-street': 'Changed 3',
+            'address-0-city': 'Odd',
+            'address-1-street': 'Street 7',
+            'address-1-city': 'Odd',
+            'address-1-DELETE': 'on',
+            'address-2-street': 'New',
+        })
+        request.user = SuperUser()
+        request._dont_enforce_csrf_checks = True
+        self.customer_admin.change_view(request, '1')
+        self.assertEqual([a.street for a in self.customer_admin.saved.address],
+            ['Street 0', 'Street 1', 'Street 2', 'Changed 3', 'Street 4', 'Street 5',
+             'Street 6', 'Street 8', 'Street 9', 'New'])
+
+
+class Document(models.Model):
+    name = models.CharField(max_length=100)
+    address_count = models.IntegerField(null=True)
+    # stands for the list field of a non relational backend
+    address = models.TextField(blank=True)
+
+    class Meta:
+        app_label = 'embedded'
+
+
+class DocumentAdmin(EmbeddedAdmin):
+    embedded = [AddressEmbedded]
+
+
+class CountedCustomerAdmin(SearchCustomerAdmin):
+    embedded_counters = {'address': 'address_count'}
+
+
+class ChangeListColumnsTest(TestCase):
+    def test_columns(self):
+        customer = SearchCustomerAdmin(Customer, AdminSite()).get_object(None, '1')
+        for i, address in enumerate(customer.address):
+            address.pk = i
+        self.assertEqual(EmbeddedCount('address')(customer), 10)
+        self.assertEqual(EmbeddedCount('address', counter='address_count')(customer), 10)
+        customer.address_count = 3
+        self.assertEqual(EmbeddedCount('address', counter='address_count')(customer), 3)
+        self.assertEqual(EmbeddedPreview('address', 2, 'street')(customer),
+            u'Street 0, Street 1 (+8)')
+        self.assertEqual(EmbeddedAggregate('address', 'pk')(customer), 45)
+        self.assertEqual(EmbeddedAggregate('address', 'pk', max)(Customer()), None)
+
+    def test_changelist_defers_unread_lists(self):
+        document_admin = DocumentAdmin(Document, AdminSite())
+        count = EmbeddedCount('address', counter='address_count')
+        self.assertEqual(document_admin.get_deferred_embedded(['name', count]), ['address'])
+        self.assertEqual(document_admin.get_deferred_embedded(
+            ['name', count, EmbeddedPreview('address')]), [])
+        self.assertEqual(document_admin.get_deferred_embedded(['name', 'address']), [])
+
+        request = RequestFactory().get('/')
+        ChangeList = document_admin.get_changelist(request)
+        cl = ChangeList(request, Document, ['name', count], ['name'], (), None, (),
+            False, 100, (), document_admin)
+        self.assertEqual(cl.query_set.query.deferred_loading, (set(['address']), True))
+
+    def test_changelist_without_embedded_columns_defers_nothing(self):
+        document_admin = DocumentAdmin(Document, AdminSite())
+        self.assertEqual(document_admin.get_deferred_embedded(('__str__',)), [])
+        self.assertEqual(document_admin.get_deferred_embedded(['name']), [])
+
+        request = RequestFactory().get('/')
+        ChangeList = document_admin.get_changelist(request)
+        cl = ChangeList(request, Document, ('__str__',), ('__str__',), (), None, (),
+            False, 100, (), document_admin)
+        self.assertEqual(cl.query_set.query.deferred_loading, (set(), True))
+
+    def test_counter_is_saved_with_the_list(self):
+        customer_admin = CountedCustomerAdmin(Customer, AdminSite())
+        customer_admin.embedded_backend = RecordingBackend()
+        request = RequestFactory().post('/1/', {
+            'name': 'Customer',
+            'address-TOTAL_FORMS': '1',
+            'address-INITIAL_FORMS': '0',
+            'address-POSITIONS': '',
+            'address-0-street': 'New',
+        })
+        request.user = SuperUser()
+        request._dont_enforce_csrf_checks = True
+        customer_admin.change_view(request, '1')
+        self.assertEqual(customer_admin.embedded_backend.operations[-1],
+            ('set', 1, 'address_count', None, 11))
+
+
+class UniqueAddressFormSet(BaseEmbeddedFormSet):
+    def clean(self):
+        streets = [form.cleaned_data['street'] for form in self.forms
+                   if getattr(form, 'cleaned_data', None)]
+        if len(streets) != len(set(streets)):
+            raise forms.ValidationError('Streets must be unique.')
+
+
+class SkipUnchangedTest(TestCase):
+    def setUp(self):
+        self.addresses = [Address(street='Street %d' % i) for i in range(5)]
+        self.data = {
+            'address-TOTAL_FORMS': '5',
+            'address-INITIAL_FORMS': '5',
+        }
+        for i in range(5):
+            self.data['address-%d-street' % i] = 'Street %d' % i
+        self.data['address-3-street'] = 'Changed'
+
+    def get_formset(self, **attrs):
+        embedded = AddressEmbedded(Customer, AdminSite())
+        embedded.__dict__.update(attrs)
+        FormSet = embedded.get_formset(RequestFactory().get('/'))
+        return FormSet(self.data, prefix='address', queryset=self.addresses)
+
+    def test_unchanged_forms_are_not_cleaned(self):
+        formset = self.get_formset(skip_unchanged_forms=True)
+        self.assertTrue(formset.is_valid())
+        self.assertEqual([hasattr(f, 'cleaned_data') for f in formset.forms],
+            [False, False, False, True, False])
+        saved = formset.save_embedded()
+        self.assertTrue(saved[0] is self.addresses[0])
+        self.assertEqual(saved[3].street, 'Changed')
+        self.assertEqual(len(formset.changed_objects), 1)
+
+    def test_all_forms_are_cleaned_by_default(self):
+        self.data['address-3-street'] = 'Street 0'
+        formset = self.get_formset(formset=UniqueAddressFormSet)
+        self.assertFalse(formset.is_valid())
+
+    def test_saves_the_instances_built_while_cleaning(self):
+        self.data['address-TOTAL_FORMS'] = '6'
+        self.data['address-5-street'] = 'New'
+        formset = self.get_formset()
+        self.assertTrue(formset.is_valid())
+        saved = formset.save_embedded()
+        self.assertTrue(saved[3] is formset.forms[3].instance)
+        self.assertTrue(saved[5] is formset.forms[5].instance)
+        self.assertFalse(hasattr(formset.forms[3], 'save_m2m'))
+        self.assertEqual((saved[3].street, saved[5].street), ('Changed', 'New'))
+
+        customer = Customer(name='Customer')
+        ReplaceBackend().save(CustomerAdmin(Customer, AdminSite()), None,
+            customer, None, [formset.changeset], change=True)
+        self.assertEqual([a.street for a in customer.address],
+            ['Street 0', 'Street 1', 'Street 2', 'Changed', 'Street 4', 'New'])
+
+    def test_compact_records_release_the_forms(self):
+        self.data['address-TOTAL_FORMS'] = '6'
+        self.data['address-5-street'] = 'New'
+        formset = self.get_formset(compact_records=True)
+        saved = formset.save_embedded()
+        self.assertEqual(formset.forms, [])
+        self.assertTrue(formset.is_valid())
+        self.assertTrue(formset.save_embedded() is saved)
+        self.assertTrue(saved[0] is self.addresses[0])
+        self.assertTrue(isinstance(saved[3], EmbeddedRecord))
+        self.assertEqual((saved[3].street, saved[5].street), ('Changed', 'New'))
+        self.assertEqual(force_unicode(formset.changed_objects[0][0]), u'Address object')
+        customer_admin = CustomerAdmin(Customer, AdminSite())
+        self.assertEqual(customer_admin.construct_change_message(None, UnchangedForm(), [], [formset]),
+            u'Changed street (1) of 1 address at 3. Added 1 address.')
+
+        customer = Customer(name='Customer')
+        ReplaceBackend().save(customer_admin, None,
+            customer, None, [formset.changeset], change=True)
+        self.assertTrue(isinstance(customer.address[3], Address))
+        self.assertTrue(customer.address[3] is formset.changeset.updates[0][1])
+        self.assertEqual([a.street for a in customer.address],
+            ['Street 0', 'Street 1', 'Street 2', 'Changed', 'Street 4', 'New'])
+
+
+class FakeTimer(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        self.now += 1.0
+        return self.now
+
+
+class TimingsTest(TestCase):
+    def test_phases_add_up(self):
+        timings = ViewTimings('change_view', timer=FakeTimer())
+        timings.phase('construct_formsets')
+        timings.phase('all_valid')
+        timings.phase('construct_formsets')
+        timings.finish()
+        self.assertEqual(timings.items(),
+            [('construct_formsets', 2.0), ('all_valid', 1.0)])
+        self.assertEqual(timings.total, 4.0)
+
+    def test_timed_response_reports(self):
+        received = []
+
+        def receiver(sender, request, timings, **kwargs):
+            received.append(timings)
+        embedded_view_timed.connect(receiver)
+        try:
+            customer_admin = CustomerAdmin(Customer, AdminSite())
+            timings = ViewTimings('change_view')
+            timings.phase('render')
+            customer_admin.timed_response(None, timings, HttpResponse())
+        finally:
+            embedded_view_timed.disconnect(receiver)
+        self.assertEqual(received, [timings])
+        self.assertEqual(timings.order, ['render'])
+
+
+class BenchmarkTest(TestCase):
+    def test_run_benchmarks(self):
+        results = list(run_benchmarks(sizes=[3], repeat=1, trace_memory=False))
+        self.assertEqual([(r['view'], r['method']) for r in results], [
+            ('add_view', 'GET'), ('add_view', 'POST'),
+            ('change_view', 'GET'), ('change_view', 'POST'),
+        ])
+        change_post = results[-1]
+        self.assertEqual(change_post['rows'], {'benchmarkaddress': 3})
+        self.assertTrue('save_embedded_formset' in change_post['phases'])
+        simplejson.dumps(results)
+
+    def test_run_compact_benchmarks(self):
+        results = list(run_benchmarks(sizes=[3], repeat=1, trace_memory=False, compact=True))
+        self.assertEqual([r['compact'] for r in results], [True] * 4)
+        self.assertTrue('save_embedded_formset' in results[-1]['phases'])
+
+    def test_run_benchmarks_measures_memory(self):
+        results = list(run_benchmarks(sizes=[3], repeat=1))
+        change_post = results[-1]
+        self.assertTrue('save_embedded_formset' in change_post['phases'])
+        self.assertEqual(set(change_post['phase_objects']), set(change_post['phases']))
+        self.assertTrue(change_post['peak_rss_kb'] >= 0)
+        simplejson.dumps(results)
+
+    def test_run_startup_benchmark(self):
+        result = run_startup_benchmark(admins=2, repeat=1)
+        self.assertEqual(result['admins'], 2)
+        for key in ('import_django_admin', 'import_embedded_admin', 'register', 'resolve'):
+            self.assertTrue(result[key] >= 0)
+
+
+class RegisteredAddressEmbedded(AddressEmbedded):
+    instances = 0
+
+    def __init__(self, *args, **kwargs):
+        RegisteredAddressEmbedded.instances += 1
+        super(RegisteredAddressEmbedded, self).__init__(*args, **kwargs)
+
+
+class LazyRegistryCustomerAdmin(EmbeddedAdmin):
+    embedded = [RegisteredAddressEmbedded]
+
+
+class EagerContactEmbedded(ContactEmbedded):
+    def __init__(self, *args, **kwargs):
+        super(EagerContactEmbedded, self).__init__(*args, **kwargs)
+        self.phones = self.embedded_instances[0]
+
+
+class EagerContactCustomerAdmin(EmbeddedAdmin):
+    embedded = [EagerContactEmbedded]
+
+
+class EmbeddedRegistryTest(TestCase):
+    def setUp(self):
+        RegisteredAddressEmbedded.instances = 0
+
+    def test_resolved_on_first_use(self):
+        site = AdminSite()
+        site.register(Customer, LazyRegistryCustomerAdmin)
+        self.assertEqual(RegisteredAddressEmbedded.instances, 0)
+        customer_admin = site._registry[Customer]
+        embedded = customer_admin.embedded_instances[0]
+        self.assertTrue(isinstance(embedded, RegisteredAddressEmbedded))
+        self.assertTrue(customer_admin.get_embedded_instance('address') is embedded)
+        self.assertEqual(RegisteredAddressEmbedded.instances, 1)
+
+    def test_cached_per_admin_site(self):
+        site = AdminSite()
+        first = LazyRegistryCustomerAdmin(Customer, site)
+        second = LazyRegistryCustomerAdmin(Customer, site)
+        other = LazyRegistryCustomerAdmin(Customer, AdminSite())
+        self.assertTrue(first.embedded_instances[0] is second.embedded_instances[0])
+        self.assertFalse(first.embedded_instances[0] is other.embedded_instances[0])
+        self.assertEqual(RegisteredAddressEmbedded.instances, 2)
+
+    def test_nested_admins_resolved_while_building(self):
+        customer_admin = EagerContactCustomerAdmin(Customer, AdminSite())
+        embedded = customer_admin.embedded_instances[0]
+        self.assertTrue(isinstance(embedded.phones, PhoneEmbedded))
+
+
+class LinkedAddress(Address):
+    class Meta:
+        proxy = True
+        app_label = 'embedded'
+
+    def get_absolute_url(self):
+        return '/addresses/%s/' % self.street
+
+
+class LinkedAddressEmbedded(TabularEmbedded):
+    model = LinkedAddress
+
+
+class EmbeddedAdminFormSetTest(TestCase):
+    def get_admin_formset(self, embedded_class, model):
+        embedded = embedded_class(Customer, AdminSite())
+        request = RequestFactory().get('/')
+        FormSet = embedded.get_formset(request)
+        formset = FormSet(prefix='address',
+            queryset=[model(street='Street %d' % i) for i in range(20)])
+        return EmbeddedAdminFormSet(embedded, formset,
+            list(embedded.get_fieldsets(request)), model_admin=None)
+
+    def test_content_type_is_looked_up_once(self):
+        ContentType.objects.clear_cache()
+        admin_formset = self.get_admin_formset(LinkedAddressEmbedded, LinkedAddress)
+        with self.assertNumQueries(1):
+            admin_forms = list(admin_formset)
+        self.assertEqual(len(set([f.original_content_type_id for f in admin_forms[:20]])), 1)
+        self.assertTrue(admin_forms[0].show_url)
+
+    def test_no_lookup_without_absolute_url(self):
+        ContentType.objects.clear_cache()
+        admin_formset = self.get_admin_formset(AddressEmbedded, Address)
+        with self.assertNumQueries(0):
+            list(admin_formset)
+
+    def test_field_layout_is_shared(self):
+        embedded = AddressEmbedded(Customer, AdminSite())
+        embedded.readonly_fields = ('city',)
+        request = RequestFactory().get('/')
+        admin_formsets = []
+        for i in range(2):
+            FormSet = embedded.get_formset(request)
+            formset = FormSet(prefix='address',
+                queryset=[Address(street='Street', city='Madrid')])
+            admin_formsets.append(EmbeddedAdminFormSet(embedded, formset,
+                list(embedded.get_fieldsets(request)),
+                list(embedded.get_readonly_fields(request))))
+        self.assertTrue(admin_formsets[0].layout() is admin_formsets[1].layout())
+        self.assertEqual([getattr(c, 'label', None) or c['label'] for c in admin_formsets[0].fields()],
+            ['Street', 'city'])
+        admin_form = list(admin_formsets[0])[0]
+        fields = [field for fieldset in admin_form for line in fieldset for field in line]
+        self.assertEqual(fields[1].contents(), 'Madrid')
+        self.assertEqual(fields[1].field['label'], 'city')
+
+
+    def test_unnamed_fieldsets_keep_their_fields(self):
+        embedded = AddressEmbedded(Customer, AdminSite())
+        embedded.fieldsets = ((None, {'fields': ['street']}), (None, {'fields': ['city']}))
+        request = RequestFactory().get('/')
+        FormSet = embedded.get_formset(request)
+        formset = FormSet(prefix='address', queryset=[Address(street='Street', city='Madrid')])
+        admin_formset = EmbeddedAdminFormSet(embedded, formset,
+            list(embedded.get_fieldsets(request)), model_admin=None)
+        admin_form = list(admin_formset)[0]
+        self.assertEqual([[field.field.name for line in fieldset for field in line]
+            for fieldset in admin_form], [['street'], ['city']])
+
+class ViewOnlyAddressEmbedded(AddressEmbedded):
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def render_readonly_row(self, element, values):
+        self.rendered += 1
+        return super(ViewOnlyAddressEmbedded, self).render_readonly_row(element, values)
+
+
+class ReadOnlyEmbeddedTest(TestCase):
+    def test_rows_are_rendered_once(self):
+        customer_admin = CustomerAdmin(Customer, AdminSite())
+        embedded = ViewOnlyAddressEmbedded(Customer, AdminSite())
+        embedded.rendered = 0
+        request = RequestFactory().get('/')
+        self.assertTrue(embedded.is_readonly(request))
+        customer = Customer(pk=1, name='Customer')
+        customer.address = [Address(street='Street %d' % i, city='<b>') for i in range(3)]
+        rows = customer_admin.get_readonly_embedded(request, customer, embedded, 'address')
+        rows.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        self.assertEqual(rows.headers(), ['street', 'city'])
+        self.assertEqual(rows.rows()[0], '<tr><td>Street 0</td><td>&lt;b&gt;</td></tr>')
+        customer.address[1].street = 'Changed'
+        rows = ReadOnlyEmbeddedRows(embedded, customer, 'address', customer.address,
+            rows.fields, cache=rows.cache, timeout=60)
+        self.assertTrue('Changed' in rows.render())
+        self.assertEqual(embedded.rendered, 4)
+
+    def test_rows_are_cached_per_language(self):
+        embedded = ViewOnlyAddressEmbedded(Customer, AdminSite())
+        embedded.rendered = 0
+        customer = Customer(pk=1, name='Customer')
+        customer.address = [Address(street='Street')]
+        cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+        try:
+            for language in ('en', 'es', 'en'):
+                translation.activate(language)
+                ReadOnlyEmbeddedRows(embedded, customer, 'address', customer.address,
+                    ('street',), cache=cache, timeout=60).render()
+        finally:
+            translation.deactivate()
+        self.assertEqual(embedded.rendered, 2)
+
+    def test_sections_template(self):
+        customer_admin = LazyCustomerAdmin(Customer, AdminSite())
+        embedded = ViewOnlyAddressEmbedded(Customer, AdminSite())
+        embedded.rendered = 0
+        customer = Customer(pk=1, name='Customer')
+        customer.address = [Address(street='Street 0')]
+        request = RequestFactory().get('/')
+        html = render_to_string('embedded/embedded_sections.html', {
+            'embedded_admin_formsets': [],
+            'lazy_embedded': [customer_admin.get_lazy_placeholder(
+                customer_admin.embedded_instances[0], 'address')],
+            'readonly_embedded': [customer_admin.get_readonly_embedded(
+                request, customer, embedded, 'locked')],
+        })
+        self.assertTrue('href="embedded/address/"' in html)
+        self.assertTrue('<th>Street</th>' in html)
+        self.assertTrue('<td>Street 0</td>' in html)
+
+
+class TransferTest(TestCase):
+    def setUp(self):
+        self.customer_admin = LazyCustomerAdmin(Customer, AdminSite())
+        self.embedded = self.customer_admin.embedded_instances[0]
+        self.customer = Customer(pk=1, name='Customer')
+        self.customer.address = [Address(street=u'Calle \xd1 %d' % i, city='Madrid, ES')
+            for i in range(3)]
+
+    def test_csv_round_trip(self):
+        lines = list(self.customer_admin.export_embedded(None, self.customer,
+            self.embedded, 'csv'))
+        self.assertEqual(lines[0], 'street,city\r\n')
+        self.assertEqual(len(lines), 4)
+        other = Customer(pk=2, name='Other')
+        other.address = [Address(street='Old')]
+        changeset = self.customer_admin.import_embedded(None, other, self.embedded,
+            read_rows('csv', lines), mode='replace', chunk_size=2)
+        self.assertEqual(changeset.removals, [0])
+        self.assertEqual([(a.street, a.city) for a in other.address],
+            [(u'Calle \xd1 %d' % i, u'Madrid, ES') for i in range(3)])
+
+    def test_invalid_rows_are_reported(self):
+        lines = ['{"street": "New"}\n', '{"city": "No street"}\n', '\n', '[1]\n']
+        read = []
+        try:
+            self.customer_admin.import_embedded(None, self.customer, self.embedded,
+                read_rows('jsonl', lines), chunk_size=1, progress=read.append)
+        except EmbeddedImportError as e:
+            self.assertEqual([number for number, errors in e.errors], [2, 3])
+            self.assertTrue('street' in e.errors[0][1])
+        else:
+            self.fail('The import should have failed.')
+        self.assertEqual(read, [1, 2, 3])
+        self.assertEqual(len(self.customer.address), 3)
+
+    def test_import_view_appends(self):
+        upload = SimpleUploadedFile('addresses.jsonl',
+            '{"street": "New 1"}\n{"street": "New 2", "city": "Lugo"}\n')
+        request = RequestFactory().post('/1/embedded/address/import/',
+            {'file': upload, 'format': 'jsonl'})
+        request.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        request._dont_enforce_csrf_checks = True
+        response = self.customer_admin.embedded_import_view(request, '1', 'address')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(simplejson.loads(response.content), {'length': 12, 'imported': 2})
+
+
+ADDRESSES = {}
+
+
+class StoredAddressEmbedded(AddressEmbedded):
+    def queryset(self, request, parent_instance=None):
+        return ADDRESSES.get(parent_instance.pk, [])
+
+
+class BulkCustomerAdmin(CustomerAdmin):
+    embedded = [StoredAddressEmbedded]
+
+    def save_model(self, request, obj, form, change):
+        ADDRESSES[obj.pk] = obj.address
+        obj.save()
+
+
+class BulkEditTest(TestCase):
+    def setUp(self):
+        self.customer_admin = BulkCustomerAdmin(Customer, AdminSite())
+        ADDRESSES.clear()
+        for i in range(5):
+            customer = Customer.objects.create(name='Customer %d' % i)
+            ADDRESSES[customer.pk] = [Address(street='Home', city='Old'),
+                                      Address(street='Work', city='Keep')]
+        self.pks = list(Customer.objects.values_list('pk', flat=True))
+        self.cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+
+    def test_updates_matching_elements_in_chunks(self):
+        job = EmbeddedBulkEdit(self.customer_admin, 'address', self.pks, 'update',
+            value={'city': 'New'}, match={'city': 'Old'}, chunk_size=2, cache=self.cache)
+        seen = []
+        state = job.run(progress=lambda state: seen.append(state['position']))
+        self.assertEqual(seen, [2, 4, 5])
+        self.assertEqual((state['changed'], state['failed'], state['done']), (5, [], True))
+        self.assertEqual([(a.street, a.city) for a in ADDRESSES[self.pks[4]]],
+            [('Home', 'New'), ('Work', 'Keep')])
+        self.assertEqual(job.checkpoint()['position'], 0)
+
+    def test_resumes_from_checkpoint(self):
+        job = EmbeddedBulkEdit(self.customer_admin, 'address', self.pks, 'append',
+            value={'street': 'Phone'}, chunk_size=2, cache=self.cache)
+        self.cache.set(job.key, {'position': 4, 'total': 5, 'changed': 4,
+                                 'failed': [], 'done': False})
+        state = job.run()
+        self.assertEqual(state['changed'], 5)
+        self.assertEqual([len(ADDRESSES[pk]) for pk in self.pks], [2, 2, 2, 2, 3])
+
+    def test_retries_failed_objects_on_resume(self):
+        job = EmbeddedBulkEdit(self.customer_admin, 'address', self.pks, 'append',
+            value={'street': 'Phone'}, chunk_size=2, cache=self.cache)
+        self.cache.set(job.key, {'position': 4, 'total': 5, 'changed': 3,
+                                 'failed': [(self.pks[1], {'street': ['Error']})],
+                                 'done': False})
+        seen = []
+        state = job.run(progress=lambda state: seen.append(state['position']))
+        self.assertEqual(seen, [4, 5])
+        self.assertEqual((state['changed'], state['failed'], state['done']), (5, [], True))
+        self.assertEqual([len(ADDRESSES[pk]) for pk in self.pks], [2, 3, 2, 2, 3])
+        self.assertEqual(self.cache.get(job.key), None)
+
+    def test_interrupted_job_stays_resumable(self):
+        job = EmbeddedBulkEdit(self.customer_admin, 'address', self.pks, 'append',
+            value={'city': 'No street'}, chunk_size=2, cache=self.cache)
+        def interrupt(state):
+            raise KeyboardInterrupt
+        self.assertRaises(KeyboardInterrupt, job.run, progress=interrupt)
+        state = job.checkpoint()
+        self.assertEqual((state['position'], state['done']), (2, False))
+        self.assertEqual([pk for pk, errors in state['failed']], self.pks[:2])
+
+    def test_invalid_elements_fail(self):
+        job = EmbeddedBulkEdit(self.customer_admin, 'address', self.pks[:2], 'append',
+            value={'city': 'No street'}, cache=self.cache)
+        state = job.run()
+        self.assertEqual(state['changed'], 0)
+        self.assertEqual([pk for pk, errors in state['failed']], self.pks[:2])
+        self.assertTrue('street' in state['failed'][0][1])
+
+    def test_changelist_action(self):
+        request = RequestFactory().post('/', {'apply': '1', 'embedded': 'address',
+            'action': 'bulk_edit_embedded', 'operation': 'remove', 'match_field': 'street', 'match_value': 'Work'})
+        request.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        response = self.customer_admin.bulk_edit_embedded(request,
+            Customer.objects.filter(pk__in=self.pks[:3]))
+        self.assertEqual(response, None)
+        self.assertEqual([len(ADDRESSES[pk]) for pk in self.pks], [1, 1, 1, 2, 2])
+        self.assertTrue('3 of 3' in request.user.get_and_delete_messages()[0])
+
+
+class LockedAddressEmbedded(LazyAddressEmbedded):
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class LockedCustomerAdmin(LazyCustomerAdmin):
+    embedded = [LockedAddressEmbedded]
+
+
+class LockedStoredAddressEmbedded(StoredAddressEmbedded):
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class LockedBulkCustomerAdmin(BulkCustomerAdmin):
+    embedded = [LockedStoredAddressEmbedded]
+
+
+class LockedPhoneEmbedded(PhoneEmbedded):
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class LockedPhoneContactEmbedded(ContactEmbedded):
+    embedded = [LockedPhoneEmbedded]
+
+
+class LockedPhoneCustomerAdmin(ContactCustomerAdmin):
+    embedded = [LockedPhoneContactEmbedded]
+
+
+class SavingLockedCustomerAdmin(LockedCustomerAdmin):
+    def save_model(self, request, obj, form, change):
+        self.saved = obj
+        obj.save()
+
+
+class EmbeddedPermissionTest(TestCase):
+    def setUp(self):
+        self.customer_admin = LockedCustomerAdmin(Customer, AdminSite())
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def post(self, path, data, **kwargs):
+        request = RequestFactory().post(path, data, **kwargs)
+        request.user = self.user
+        request._dont_enforce_csrf_checks = True
+        return request
+
+    def test_patch_is_denied(self):
+        request = self.post('/1/embedded/address/patch/',
+            simplejson.dumps([{'op': 'remove', 'index': 0}]), content_type='application/json')
+        self.assertRaises(PermissionDenied, self.customer_admin.embedded_patch_view,
+            request, '1', 'address')
+
+    def test_import_is_denied(self):
+        request = self.post('/1/embedded/address/import/', {'format': 'jsonl',
+            'file': SimpleUploadedFile('addresses.jsonl', '{"street": "New"}\n')})
+        self.assertRaises(PermissionDenied, self.customer_admin.embedded_import_view,
+            request, '1', 'address')
+
+    def test_bulk_edit_skips_locked_lists(self):
+        customer = Customer.objects.create(name='Customer')
+        ADDRESSES.clear()
+        ADDRESSES[customer.pk] = [Address(street='Home')]
+        customer_admin = LockedBulkCustomerAdmin(Customer, AdminSite())
+        job = EmbeddedBulkEdit(customer_admin, 'address', [customer.pk], 'remove',
+            cache=get_cache('django.core.cache.backends.locmem.LocMemCache'))
+        state = job.run()
+        self.assertEqual((state['changed'], [pk for pk, errors in state['failed']]),
+            (0, [customer.pk]))
+        self.assertEqual(len(ADDRESSES[customer.pk]), 1)
+        request = self.post('/', {'action': 'bulk_edit_embedded', 'embedded': 'address'})
+        self.assertRaises(PermissionDenied, customer_admin.bulk_edit_embedded,
+            request, Customer.objects.all())
+
+    def test_embedded_view_renders_rows_without_forms(self):
+        request = RequestFactory().get('/1/embedded/address/', {'offset': '4', 'limit': '3'})
+        request.user = self.user
+        response = self.customer_admin.embedded_view(request, '1', 'address')
+        self.assertContains(response, '<td>Street 4</td>')
+        self.assertNotContains(response, 'Street 7')
+        self.assertNotContains(response, '<input')
+
+    def test_posts_to_locked_lists_are_ignored_on_add(self):
+        customer_admin = SavingLockedCustomerAdmin(Customer, AdminSite())
+        data = {
+            'name': 'Customer',
+            '_saveasnew': 'Save as new',
+            'address-TOTAL_FORMS': '1',
+            'address-INITIAL_FORMS': '0',
+            'address-0-street': 'Injected',
+        }
+        customer_admin.change_view(self.post('/1/', data), '1')
+        self.assertEqual(customer_admin.saved.name, 'Customer')
+        self.assertEqual(getattr(customer_admin.saved, 'address', []), [])
+
+    def test_nested_view_and_post_respect_locked_lists(self):
+        customer_admin = LockedPhoneCustomerAdmin(Customer, AdminSite())
+        request = RequestFactory().get('/1/embedded/contact/2/phone/')
+        request.user = self.user
+        response = customer_admin.embedded_nested_view(request, '1', 'contact', '2/phone/')
+        self.assertContains(response, '<td>2-1</td>')
+        self.assertNotContains(response, '<input')
+
+        data = {
+            'name': 'Customer',
+            'contact-TOTAL_FORMS': '1',
+            'contact-INITIAL_FORMS': '1',
+            'contact-0-name': 'Contact 0',
+            'contact-0-phone-TOTAL_FORMS': '1',
+            'contact-0-phone-INITIAL_FORMS': '0',
+            'contact-0-phone-0-number': 'New',
+        }
+        customer_admin.change_view(self.post('/1/', data), '1')
+        self.assertEqual([p.number for p in customer_admin.saved.contact[0].phone],
+            ['0-0', '0-1'])
+
+
+class CountingFormSet(BaseEmbeddedFormSet):
+    built = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingFormSet.built += 1
+        super(CountingFormSet, self).__init__(*args, **kwargs)
+
+
+class CountingAddressEmbedded(AddressEmbedded):
+    formset = CountingFormSet
+    fieldsets_calls = 0
+
+    def get_fieldsets(self, request, obj=None):
+        CountingAddressEmbedded.fieldsets_calls += 1
+        return super(CountingAddressEmbedded, self).get_fieldsets(request, obj)
+
+
+class ContextCustomerAdmin(CustomerAdmin):
+    embedded = [CountingAddressEmbedded]
+
+    def has_add_permission(self, request):
+        return True
+
+    def render_change_form(self, request, context, **kwargs):
+        self.context = context
+        return HttpResponse('')
+
+
+class PipelineTest(TestCase):
+    def setUp(self):
+        CountingFormSet.built = 0
+        CountingAddressEmbedded.fieldsets_calls = 0
+        self.customer_admin = ContextCustomerAdmin(Customer, AdminSite())
+
+    def test_add_view_builds_each_formset_once(self):
+        Address.objects.create(street='Somebody else')
+        self.customer_admin.add_view(RequestFactory().get('/'))
+        embedded_admin_formsets = self.customer_admin.context['embedded_admin_formsets']
+        self.assertEqual(CountingFormSet.built, 1)
+        self.assertEqual(len(embedded_admin_formsets), 1)
+        formset = embedded_admin_formsets[0].formset
+        self.assertEqual((formset.prefix, formset.initial_form_count()), ('address', 0))
+        self.assertEqual(CountingAddressEmbedded.fieldsets_calls, 1)
+
+    def test_invalid_add_keeps_the_posted_formset(self):
+        request = RequestFactory().post('/', {
+            'name': '',
+            'address-TOTAL_FORMS': '1',
+            'address-INITIAL_FORMS': '0',
+            'address-0-street': 'Posted',
+        })
+        request._dont_enforce_csrf_checks = True
+        self.customer_admin.add_view(request)
+        formset = self.customer_admin.context['embedded_admin_formsets'][0].formset
+        self.assertEqual(CountingFormSet.built, 1)
+        self.assertEqual(formset.forms[0]['street'].data, 'Posted')
+        self.assertTrue(formset.management_form is formset.management_form)
+
+    def test_embedded_errors_are_listed(self):
+        request = RequestFactory().post('/', {
+            'name': 'Customer',
+            'address-TOTAL_FORMS': '1',
+            'address-INITIAL_FORMS': '0',
+            'address-0-street': '',
+            'address-0-city': 'Posted',
+        })
+        request._dont_enforce_csrf_checks = True
+        self.customer_admin.add_view(request)
+        errors = self.customer_admin.context['errors']
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0], [u'This field is required.'])
+
+    def test_missing_keys_are_cheap(self):
+        data = EmbeddedFormData({'address-0-street': ['Street'] * 1000})
+        self.assertEqual(data.get('address-0-city'), None)
+        try:
+            data['address-0-city']
+        except KeyError as e:
+            self.assertEqual(e.args, ('address-0-city',))
+
+
+class SlowAddressForm(forms.ModelForm):
+    threads = set()
+
+    class Meta:
+        model = Address
+
+    def clean_city(self):
+        # stands for a call to an address normalization service
+        time.sleep(0.01)
+        SlowAddressForm.threads.add(threading.current_thread().ident)
+        if self.cleaned_data['city'] == 'Nowhere':
+            raise forms.ValidationError('Unknown city.')
+        return self.cleaned_data['city']
+
+
+class ConcurrentValidationTest(TestCase):
+    def get_formsets(self, customer_admin):
+        embedded = customer_admin.embedded_instances[0]
+        embedded.form = SlowAddressForm
+        embedded.validation_chunk_size = 3
+        data = {'address-TOTAL_FORMS': '10', 'address-INITIAL_FORMS': '0'}
+        for i in range(10):
+            data['address-%d-street' % i] = i % 4 and 'Street %d' % i or ''
+            data['address-%d-city' % i] = i % 3 and 'City' or 'Nowhere'
+        FormSet = embedded.get_formset(None)
+        return [FormSet(data, prefix='address', queryset=[])]
+
+    def test_errors_match_the_sequential_path(self):
+        customer_admin = CustomerAdmin(Customer, AdminSite())
+        customer_admin.formset_cache = None
+        sequential = self.get_formsets(customer_admin)
+        self.assertFalse(customer_admin.validate_embedded_formsets(None, sequential))
+
+        SlowAddressForm.threads.clear()
+        customer_admin.validation_workers = 4
+        concurrent = self.get_formsets(customer_admin)
+        self.assertFalse(customer_admin.validate_embedded_formsets(None, concurrent))
+        self.assertTrue(len(SlowAddressForm.threads) > 1)
+        self.assertTrue(threading.current_thread().ident not in SlowAddressForm.threads)
+        self.assertEqual(concurrent[0].errors, sequential[0].errors)
+        self.assertEqual([bool(e) for e in concurrent[0].errors],
+            [True, False, False, True, True, False, True, False, True, True])
+
+
+class ChangeMessageTest(TestCase):
+    def test_embedded_changes_are_summarized(self):
+        addresses = [Address(street='Street %d' % i) for i in range(40)]
+        data = {'address-TOTAL_FORMS': '42', 'address-INITIAL_FORMS': '40'}
+        for i in range(40):
+            data['address-%d-street' % i] = 'Street %d' % i
+        for i in range(15):
+            data['address-%d-street' % i] = 'Changed %d' % i
+            data['address-%d-city' % (i * 2)] = 'City'
+        for i in range(25, 37):
+            data['address-%d-DELETE' % i] = 'on'
+        data['address-40-street'] = 'New 1'
+        data['address-41-street'] = 'New 2'
+        customer_admin = CustomerAdmin(Customer, AdminSite())
+        FormSet = customer_admin.embedded_instances[0].get_formset(None)
+        formset = FormSet(data, prefix='address', queryset=addresses)
+        customer_admin.save_embedded_formset(formset, change=True)
+        message = customer_admin.construct_change_message(None, UnchangedForm(), [], [formset])
+        self.assertEqual(message,
+            u'Changed city (13) and street (15) of 20 addresss at '
+            u'0, 1, 2, 3, 4, 5, 6, 7, 8, 9 and 10 more. Added 2 addresss. '
+            u'Deleted 12 addresss at 25, 26, 27, 28, 29, 30, 31, 32, 33, 34 and 2 more.')
+
+    def test_no_changes(self):
+        customer_admin = CustomerAdmin(Customer, AdminSite())
+        self.assertEqual(customer_admin.construct_change_message(None, UnchangedForm(), [], []),
+            'No fields changed.')
+
+
+class VersionTest(TestCase):
+    def setUp(self):
+        self.embedded = AddressEmbedded(Customer, AdminSite())
+        self.embedded.versioned = True
+        self.FormSet = self.embedded.get_formset(None)
+        self.addresses = [Address(street='Street %d' % i) for i in range(4)]
+        formset = self.FormSet(prefix='address', queryset=self.addresses)
+        self.data = {
+            'address-TOTAL_FORMS': '5',
+            'address-INITIAL_FORMS': '4',
+            'address-VERSION': formset.management_form['VERSION'].value(),
+        }
+        for i, address in enumerate(self.addresses):
+            self.data['address-%d-street' % i] = address.street
+
+    def post(self, current):
+        return self.FormSet(self.data, prefix='address', queryset=current)
+
+    def test_non_overlapping_edits_are_merged(self):
+        current = [Address(street=a.street) for a in self.addresses]
+        current[1].city = 'Theirs'
+        self.data['address-2-street'] = 'Mine'
+        formset = self.post(current)
+        self.assertTrue(formset.is_valid())
+        saved = formset.save_embedded()
+        self.assertEqual([(a.street, a.city) for a in saved],
+            [('Street 0', ''), ('Street 1', 'Theirs'), ('Mine', ''), ('Street 3', '')])
+        self.assertEqual([p for p, a in formset.changeset.updates], [2])
+        self.assertEqual(current[1].city, 'Theirs')
+
+    def test_changeset_expects_the_version_it_was_read_at(self):
+        current = [Address(street=a.street) for a in self.addresses]
+        current[1].city = 'Theirs'
+        self.data['address-2-street'] = 'Mine'
+        formset = self.post(current)
+        self.assertTrue(formset.is_valid())
+        formset.save_embedded()
+        version = self.FormSet(prefix='address', queryset=current).get_version(window=False)
+        self.assertEqual(formset.changeset.version, version)
+        self.assertFalse(self.data['address-VERSION'].startswith(version))
+        customer = Customer(pk=1, name='Customer')
+        backend = RecordingBackend()
+        backend.save(CustomerAdmin(Customer, AdminSite()), None, customer,
+            None, [formset.changeset], change=True)
+        self.assertEqual([op[0] for op in backend.operations], ['expect', 'update'])
+        self.assertEqual(backend.operations[0][4], version)
+
+    def test_overlapping_edits_conflict(self):
+        current = [Address(street=a.street) for a in self.addresses]
+        current[1].city = 'Theirs'
+        self.data['address-1-city'] = 'Mine'
+        formset = self.post(current)
+        self.assertFalse(formset.is_valid())
+        self.assertTrue('Addresss 1 were changed' in formset.non_form_errors()[0])
+
+    def test_only_new_elements_merge_into_a_longer_list(self):
+        current = self.addresses + [Address(street='Theirs')]
+        self.data['address-4-street'] = 'Mine'
+        formset = self.post(current)
+        self.assertTrue(formset.is_valid())
+        self.assertEqual([a.street for a in formset.save_embedded()],
+            ['Street 0', 'Street 1', 'Street 2', 'Street 3', 'Theirs', 'Mine'])
+
+        self.data['address-0-street'] = 'Changed'
+        self.assertFalse(self.post(current).is_valid())
@@ -0,0 +1,165 @@
+# embedded/transfer.py
+"""
+Streaming import and export of embedded lists as CSV or JSON Lines.
+
+Exports are generators of lines, so a response or a file gets the rows as
+they are produced. Imports read the rows one by one and validate them with a
+form class, ``chunk_size`` rows at a time; only the valid elements are kept,
+never the forms nor the file.
+"""
+import csv
+from cStringIO import StringIO
+
+from django.utils import simplejson
+from django.utils.encoding import force_unicode, smart_str
+from django.utils.translation import ugettext as _
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {
+	'csv': 'text/csv; charset=utf-8',
+	'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+CHUNK_SIZE = 500
+
+class EmbeddedImportError(Exception):
+	"""
+	Raised when rows of an import don't validate. ``errors`` is a list of
+	(row number, errors dict) pairs, the first row being 1.
+	"""
+	def __init__(self, errors):
+		self.errors = errors
+		super(EmbeddedImportError, self).__init__(
+			'%d invalid rows, first one is row %d' % (len(errors), errors[0][0]))
+
+def export_fields(form_class):
+	"""
+	Returns the names of the model fields edited by ``form_class``, which are
+	the columns of an export.
+	"""
+	model_fields = set([f.name for f in form_class._meta.model._meta.fields])
+	return [name for name in form_class.base_fields if name in model_fields]
+
+def element_values(element, fields):
+	"""
+	Returns the values of ``fields`` of an embedded element as unicode.
+	"""
+	opts = element._meta
+	return [force_unicode(opts.get_field(name).value_to_string(element)) for name in fields]
+
+def csv_lines(columns, rows):
+	"""
+	Yields the header and then one UTF-8 encoded CSV line per row.
+	"""
+	buffer = StringIO()
+	writer = csv.writer(buffer)
+	for row in _with_header(columns, rows):
+		writer.writerow([smart_str(value) for value in row])
+		yield buffer.getvalue()
+		buffer.seek(0)
+		buffer.truncate()
+
+def _with_header(columns, rows):
+	yield columns
+	for row in rows:
+		yield row
+
+def jsonl_lines(columns, rows):
+	"""
+	Yields one JSON object per row, keyed by column.
+	"""
+	for row in rows:
+		yield simplejson.dumps(dict(zip(columns, row))) + '\n'
+
+def export_lines(format, columns, rows):
+	if format == 'csv':
+		return csv_lines(columns, rows)
+	if format == 'jsonl':
+		return jsonl_lines(columns, rows)
+	raise ValueError('Unknown format %r.' % format)
+
+def read_csv(lines):
+	"""
+	Yields the rows of UTF-8 encoded CSV lines as dicts, keyed by the names
+	of the header.
+	"""
+	for row in csv.DictReader(lines):
+		yield dict([(force_unicode(key), force_unicode(value or ''))
+			for key, value in row.items() if key is not None])
+
+def read_jsonl(lines):
+	"""
+	Yields the value of every non blank JSON line. Lines that can't be
+	parsed are yielded as None.
+	"""
+	for line in lines:
+		if not line.strip():
+			continue
+		try:
+			yield simplejson.loads(line)
+		except ValueError:
+			yield None
+
+def read_rows(format, lines):
+	if format == 'csv':
+		return read_csv(lines)
+	if format == 'jsonl':
+		return read_jsonl(lines)
+	raise ValueError('Unknown format %r.' % format)
+
+def iter_chunks(iterable, size):
+	"""
+	Yields lists of up to ``size`` items of ``iterable``.
+	"""
+	chunk = []
+	for item in iterable:
+		chunk.append(item)
+		if len(chunk) >= size:
+			yield chunk
+			chunk = []
+	if chunk:
+		yield chunk
+
+def validate_rows(rows, form_class, chunk_size=CHUNK_SIZE):
+	"""
+	Validates rows of form data with ``form_class`` and yields, per chunk of
+	``chunk_size`` rows, the list of valid elements and the list of (row
+	number, errors) pairs of the invalid ones.
+	"""
+	number = 0
+	for chunk in iter_chunks(rows, chunk_size):
+		elements = []
+		errors = []
+		for row in chunk:
+			number += 1
+			if not isinstance(row, dict):
+				errors.append((number, {'row': [_('Expected an object.')]}))
+				continue
+			form = form_class(data=row)
+			if form.is_valid():
+				elements.append(form.save(commit=False))
+			else:
+				errors.append((number, form.errors))
+		yield elements, errors
+
+def import_elements(rows, form_class, chunk_size=CHUNK_SIZE, max_errors=100,
+					progress=None):
+	"""
+	Returns the elements of ``rows`` validated with ``form_class``, or raises
+	EmbeddedImportError with up to ``max_errors`` errors. ``progress`` is
+	called with the number of rows read after every chunk.
+	"""
+	result = []
+	errors = []
+	read = 0
+	for elements, chunk_errors in validate_rows(rows, form_class, chunk_size):
+		read += len(elements) + len(chunk_errors)
+		errors.extend(chunk_errors[:max_errors - len(errors)])
+		if not errors:
+			result.extend(elements)
+		if progress is not None:
+			progress(read)
+		if len(errors) >= max_errors:
+			break
+	if errors:
+		raise EmbeddedImportError(errors)
+	return result